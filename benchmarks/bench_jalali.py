@@ -0,0 +1,44 @@
+"""Jalali <-> Gregorian conversion: arithmetic classes vs lookup table.
+
+Every date the picker can produce (1320-1419) is converted both ways with
+the `Persian`/`Gregorian` classes and with `to_gregorian`/`to_persian`,
+and the results are checked to agree first. Run from the repository root:
+
+    python -m benchmarks.bench_jalali
+"""
+from utils import jalali
+from benchmarks.common import bench
+
+
+
+def picker_dates():
+    return [
+        (year, month, day)
+        for year in range(jalali.TABLE_FIRST_YEAR, jalali.TABLE_LAST_YEAR + 1)
+        for month in range(1, 13)
+        for day in range(1, jalali.persian_month_length(year, month) + 1)
+    ]
+
+
+def check(dates):
+    for date in dates:
+        gregorian = jalali.Persian(date).gregorian_tuple()
+        assert jalali.to_gregorian(*date) == gregorian, date
+        assert jalali.to_persian(*gregorian) == jalali.Gregorian(gregorian).persian_tuple() == date, date
+
+
+if __name__ == "__main__":
+    dates = picker_dates()
+    gregorian_dates = [jalali.to_gregorian(*date) for date in dates]
+    check(dates)
+    print(f"{len(dates)} dates, {sum(len(table) * table.itemsize for table in (jalali.YEAR_STARTS, jalali.DAYS, jalali.GREGORIAN))} bytes of tables")
+    print()
+    print("Jalali -> Gregorian")
+    arithmetic = bench("Persian().tuple", lambda *date: jalali.Persian(date).gregorian_tuple(), dates, number=3, width=22)
+    table = bench("to_gregorian", jalali.to_gregorian, dates, number=3, width=22)
+    print(f"{'speedup':<22} {arithmetic / table:10.2f}x")
+    print()
+    print("Gregorian -> Jalali")
+    arithmetic = bench("Gregorian().tuple", lambda *date: jalali.Gregorian(date).persian_tuple(), gregorian_dates, number=3, width=22)
+    table = bench("to_persian", jalali.to_persian, gregorian_dates, number=3, width=22)
+    print(f"{'speedup':<22} {arithmetic / table:10.2f}x")
@@ -0,0 +1,67 @@
+"""Inline keyboard cost per send: rebuilt markup vs KeyboardRegistry.
+
+"rebuilt" builds the InlineKeyboardMarkup the way the helpers used to and
+serializes it the way telebot does before every request; "cached" is the
+registry lookup, whose str markup telebot passes through. For each keyboard
+the script prints CPU time per send and the peak memory a single send
+allocates (tracemalloc). Run from the repository root:
+
+    python -m benchmarks.bench_keyboards
+"""
+import timeit
+import tracemalloc
+from utils.assets import (
+    DECADES,
+    build_dashboard_keyboard,
+    build_gender_keyboard,
+    create_inline_keyboard,
+)
+from utils.keyboards import KeyboardRegistry
+
+
+
+KEYBOARDS = {
+    "dashboard": ((), build_dashboard_keyboard, {}),
+    "decade": (("kua_decade_",), create_inline_keyboard, {"options": DECADES, "columns": 2, "callback_prefix": "kua_decade_"}),
+    "year": (("kua_year_", 1360, 1369), create_inline_keyboard, {"options": range(1360, 1370), "columns": 3, "callback_prefix": "kua_year_"}),
+    "month": (("kua_month_",), create_inline_keyboard, {"options": range(1, 13), "columns": 3, "callback_prefix": "kua_month_"}),
+    "day": (("kua_day_",), create_inline_keyboard, {"options": range(1, 32), "columns": 3, "callback_prefix": "kua_day_"}),
+    "gender": (("kua_gender_",), build_gender_keyboard, {"callback_prefix": "kua_gender_"}),
+}
+
+
+def rebuilt(key, build, kwargs, registry):
+    return build(**kwargs).to_json()
+
+
+def cached(key, build, kwargs, registry):
+    return registry.get(key, build, **kwargs)
+
+
+def peak_bytes(send, *args):
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    start, _ = tracemalloc.get_traced_memory()
+    send(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak - start
+
+
+def cpu_us(send, *args, number=2000):
+    return min(timeit.repeat(lambda: send(*args), number=number, repeat=5)) / number * 1e6
+
+
+if __name__ == "__main__":
+    registry = KeyboardRegistry()
+    print(f"{'keyboard':<10} {'rebuilt us':>11} {'cached us':>10} {'rebuilt B':>10} {'cached B':>9}")
+    for name, (key, build, kwargs) in KEYBOARDS.items():
+        key = (name, *key)
+        assert rebuilt(key, build, kwargs, registry) == cached(key, build, kwargs, registry)
+        print(
+            f"{name:<10} "
+            f"{cpu_us(rebuilt, key, build, kwargs, registry):11.2f} "
+            f"{cpu_us(cached, key, build, kwargs, registry):10.3f} "
+            f"{peak_bytes(rebuilt, key, build, kwargs, registry):10d} "
+            f"{peak_bytes(cached, key, build, kwargs, registry):9d}"
+        )
@@ -0,0 +1,81 @@
+"""Lunar year of a birth date: lunardate vs the New Year table.
+
+The repository has no test suite, so this script is also the correctness
+test for utils/lunar.py: `--check` compares `lunar.chinese_year` with
+`lunardate` for every day from the 1900 New Year to the end of 2099
+(lunardate's range) and exits with status 1 on any difference. Without
+it the check runs first, then the old `extract_chinese_year` path
+(format, strptime, fromSolarDate) is timed against the table on the
+Gregorian dates of the Jalali picker. Run from the repository root:
+
+    python -m benchmarks.bench_lunar --check
+    python -m benchmarks.bench_lunar
+"""
+import sys
+import json
+import argparse
+import datetime
+import lunardate
+from utils import jalali, lunar
+from utils.assets import chinese_zodiac
+from benchmarks.common import bench
+
+
+
+def check():
+    """Days checked and the dates where the table disagrees with lunardate."""
+    date = lunardate.LunarDate(lunar.FIRST_YEAR, 1, 1).toSolarDate()
+    end = datetime.date(2099, 12, 31)
+    day = datetime.timedelta(days=1)
+    checked = 0
+    mismatches = []
+    while date <= end:
+        expected = lunardate.LunarDate.fromSolarDate(date.year, date.month, date.day).year
+        if (
+            lunar.chinese_year(date) != expected
+            or lunar.chinese_year((date.year, date.month, date.day)) != expected
+        ):
+            mismatches.append(date)
+        date += day
+        checked += 1
+    return checked, mismatches
+
+
+def lunardate_year(year, month, day):
+    date = datetime.datetime.strptime(f"{year:04d}-{month:02d}-{day:02d}", "%Y-%m-%d")
+    return int(lunardate.LunarDate.fromSolarDate(date.year, date.month, date.day).year)
+
+
+def table_year(year, month, day):
+    return lunar.chinese_year((year, month, day))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--check", action="store_true", help="only run the correctness check")
+    args = parser.parse_args()
+    checked, mismatches = check()
+    if mismatches:
+        print(f"{len(mismatches)} of {checked} days disagree with lunardate, first: {mismatches[:5]}")
+        sys.exit(1)
+    print(f"{checked} days agree with lunardate")
+    if args.check:
+        sys.exit(0)
+    dates = [
+        jalali.to_gregorian(year, month, day)
+        for year in range(jalali.TABLE_FIRST_YEAR, jalali.TABLE_LAST_YEAR + 1)
+        for month in range(1, 13)
+        for day in range(1, jalali.persian_month_length(year, month) + 1)
+    ]
+    # The animal the bot showed before, keyed by the Gregorian year
+    with open("utils/zodiac_animal_dataset.json", encoding="utf-8") as file:
+        zodiac_animal_dataset = json.load(file)
+    mismatches = sum(
+        1 for date in dates
+        if zodiac_animal_dataset[str(date[0])] != chinese_zodiac(date)[1]
+    )
+    print(f"{mismatches} picker dates where the Gregorian-year animal differs from the lunar-year one")
+    print()
+    old = bench("lunardate", lunardate_year, dates, repeat=3)
+    new = bench("table", table_year, dates, repeat=3)
+    print(f"{'speedup':<12} {old / new:10.1f}x")
@@ -0,0 +1,147 @@
+"""Interactive reply latency while a broadcast runs, with and without OutboundScheduler.
+
+Telegram is simulated by a fake `_process_request` that answers in 20 ms and
+returns 429 (retry_after=1) once more than 30 messages went out in the last
+second. A broadcast sends to 750 chats the way BroadcastEngine paced
+itself before the scheduler (8 workers, its own 25/s bucket, a pause and
+retry on 429) while one user finishes a
+Zodiac result every second in the same chat: five messages (edit, photo,
+description, audio, dashboard) sent from inside the handler of their update.
+Without the scheduler both compete for the quota and the replies hit 429s;
+with it the replies go first, and their latency matches the scheduler with
+no broadcast running. Run from the repository root:
+
+    python -m benchmarks.bench_outbound
+"""
+import time
+import asyncio
+import statistics
+from collections import deque
+from telebot import asyncio_helper
+from telebot.async_telebot import AsyncTeleBot
+from telebot.asyncio_helper import ApiTelegramException
+from utils.metrics import current_chat
+from utils.outbound import OutboundScheduler, outbound_lane, LANE_BULK
+from utils.ratelimit import TokenBucket, get_retry_after
+
+
+
+TELEGRAM_LIMIT = 30
+API_LATENCY = 0.02
+RECIPIENTS = 750
+BROADCAST_WORKERS = 8
+BROADCAST_RATE = 25
+WIZARD_INTERVAL = 1.0
+WIZARD_MESSAGES = 5
+# How long the wizard runs when there is no broadcast
+IDLE_SECONDS = 20
+
+
+class Response:
+    status = 429
+
+
+class FakeTelegram:
+
+    def __init__(self):
+        self.sent = deque()
+        self.throttled = 0
+
+    async def process_request(self, token, url, method="get", params=None, files=None, **kwargs):
+        await asyncio.sleep(API_LATENCY)
+        now = time.monotonic()
+        while self.sent and self.sent[0] < now - 1:
+            self.sent.popleft()
+        if len(self.sent) >= TELEGRAM_LIMIT:
+            self.throttled += 1
+            raise ApiTelegramException(url, Response(), {
+                "ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1",
+                "parameters": {"retry_after": 1}
+            })
+        self.sent.append(now)
+        return {"message_id": 1, "date": 0, "chat": {"id": params["chat_id"], "type": "private"}, "text": "x"}
+
+
+async def broadcast(bot):
+    outbound_lane.set(LANE_BULK)
+    limiter = TokenBucket(rate=BROADCAST_RATE)
+    queue = deque(range(1, RECIPIENTS + 1))
+    paused_until = 0.0
+
+    async def worker():
+        nonlocal paused_until
+        while queue:
+            chat_id = queue.popleft()
+            while True:
+                delay = paused_until - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                await limiter.acquire()
+                try:
+                    await bot.send_message(chat_id, "broadcast")
+                    break
+                except ApiTelegramException as e:
+                    paused_until = max(paused_until, time.monotonic() + get_retry_after(e))
+
+    await asyncio.gather(*(worker() for _ in range(BROADCAST_WORKERS)))
+
+
+async def wizard_steps(bot, done, latencies, failures):
+    chat_id = 10 ** 9
+    # Every step answers an update of the same user, like a handler would
+    current_chat.set(chat_id)
+    while not done.is_set():
+        started = time.monotonic()
+        try:
+            for _ in range(WIZARD_MESSAGES):
+                await bot.send_message(chat_id, "reply")
+            latencies.append(time.monotonic() - started)
+        except ApiTelegramException:
+            # Telebot does not retry, the user is left without an answer
+            failures.append(chat_id)
+        await asyncio.sleep(WIZARD_INTERVAL)
+
+
+async def run(label, with_scheduler, with_broadcast=True):
+    telegram = FakeTelegram()
+    asyncio_helper._process_request = telegram.process_request
+    scheduler = None
+    if with_scheduler:
+        scheduler = OutboundScheduler(rate=TELEGRAM_LIMIT)
+        scheduler.install()
+    bot = AsyncTeleBot("123:abc")
+    done = asyncio.Event()
+    latencies, failures = [], []
+    started = time.monotonic()
+    wizard = asyncio.create_task(wizard_steps(bot, done, latencies, failures))
+    if with_broadcast:
+        # Its own task, so the bulk lane does not leak into the next run
+        await asyncio.create_task(broadcast(bot))
+    else:
+        await asyncio.sleep(IDLE_SECONDS)
+    elapsed = time.monotonic() - started
+    done.set()
+    await wizard
+    if scheduler is not None:
+        scheduler.uninstall()
+    latencies.sort()
+    print(
+        f"{label:>22}: {elapsed:5.1f}s, "
+        f"{len(latencies)} wizard steps, p50 {statistics.median(latencies) * 1000:4.0f} ms, "
+        f"p95 {latencies[int(len(latencies) * 0.95)] * 1000:4.0f} ms, "
+        f"{len(failures)} steps failed, {telegram.throttled} x 429"
+    )
+
+
+async def main():
+    original = asyncio_helper._process_request
+    try:
+        await run("no scheduler", with_scheduler=False)
+        await run("scheduler, idle", with_scheduler=True, with_broadcast=False)
+        await run("scheduler, broadcast", with_scheduler=True)
+    finally:
+        asyncio_helper._process_request = original
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
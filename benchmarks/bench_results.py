@@ -0,0 +1,79 @@
+"""Kua result lookups: the JSON dict vs the compiled year table.
+
+First checks that the compiled table agrees with kua.json and with the
+closed-form formula for every year of the dataset, and that years
+outside it fall back to the formula; any difference exits with status 1,
+and `--check` stops after the check. Then times the old
+`data[gender][str(year)]` lookup against the table. (The Zodiac sign
+comes from the lunar year, see bench_lunar.) Run from the
+repository root:
+
+    python -m benchmarks.bench_results --check
+    python -m benchmarks.bench_results
+"""
+import sys
+import json
+import argparse
+from utils.assets import (
+    KUA_GENDERS,
+    compile_kua_table,
+    calculate_kua_number,
+    kua_formula,
+)
+from benchmarks.common import bench
+
+
+
+def load(path):
+    with open(path, encoding="utf-8") as file:
+        return json.load(file)
+
+
+def check(kua_table, kua_data):
+    """Lookups checked and the (gender, year) pairs where table, dataset and formula disagree."""
+    checked = 0
+    mismatches = []
+    for gender in KUA_GENDERS:
+        for year, kua_number in kua_data[gender].items():
+            if (
+                calculate_kua_number(kua_table, int(year), gender) != kua_number
+                or kua_formula(int(year), gender) != kua_number
+            ):
+                mismatches.append((gender, int(year)))
+            checked += 1
+    for year in range(1800, 2200):
+        for gender in KUA_GENDERS:
+            if calculate_kua_number(kua_table, year, gender) != kua_formula(year, gender):
+                mismatches.append((gender, year))
+            checked += 1
+    return checked, mismatches
+
+
+def dict_kua_number(kua_data, birth_year, gender):
+    # calculate_kua_number before the tables
+    return kua_data.get(gender, {}).get(str(birth_year), None)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--check", action="store_true", help="only run the correctness check")
+    args = parser.parse_args()
+    kua_data = load("utils/kua.json")
+    kua_table = compile_kua_table(kua_data)
+    checked, mismatches = check(kua_table, kua_data)
+    if mismatches:
+        print(f"{len(mismatches)} of {checked} Kua lookups disagree, first: {mismatches[:5]}")
+        sys.exit(1)
+    print(
+        f"Kua {kua_table.base}-{kua_table.base + kua_table.span - 1} ({len(kua_table.data)} bytes) "
+        f"agrees with the dataset and the formula in {checked} lookups"
+    )
+    if args.check:
+        sys.exit(0)
+    # Gregorian years of the Jalali date picker
+    years = [(year,) for year in range(1941, 2041)] * 10
+    print()
+    print("Kua")
+    old = bench("dict", lambda year: dict_kua_number(kua_data, year, "female"), years, number=20, width=8)
+    new = bench("table", lambda year: calculate_kua_number(kua_table, year, "female"), years, number=20, width=8)
+    print(f"{'speedup':<8} {old / new:10.2f}x")
@@ -0,0 +1,132 @@
+"""Per-update dispatch cost: linear lambda chain vs CallbackRouter.
+
+The chain reproduces the `callback_query_handler` predicates app.py used to
+register, in registration order, plus the `call.data.split("_")` each handler
+did afterwards. Both are measured bare and through AsyncTeleBot's own update
+processing, which tests every handler's filters in turn. Run from the
+repository root:
+
+    python -m benchmarks.bench_router
+"""
+import time
+import asyncio
+from types import SimpleNamespace
+from telebot.async_telebot import AsyncTeleBot
+from utils.router import CallbackRouter
+from benchmarks.common import bench
+
+
+
+SAMPLES = [
+    "kua_button",
+    "confirm_join",
+    "kua_decade_1360",
+    "kua_year_1367",
+    "kua_month_5",
+    "kua_day_23",
+    "kua_gender_female",
+    "zodiac_decade_1370",
+    "zodiac_year_1375",
+    "zodiac_month_11",
+    "zodiac_day_30",
+]
+
+
+def handler(data):
+    return data
+
+
+def build_chain():
+    def parsed(data):
+        return data.split("_")[2]
+    return [
+        (lambda data: data in ["mashhad_button", "kua_button", "zodiac_button", "help_button", "start_button"], handler),
+        (lambda data: data == "confirm_join", handler),
+        (lambda data: data.startswith("kua_decade_"), parsed),
+        (lambda data: data.startswith("kua_year_"), parsed),
+        (lambda data: data.startswith("kua_month_"), parsed),
+        (lambda data: data.startswith("kua_day_"), parsed),
+        (lambda data: data.startswith("kua_gender_"), parsed),
+        (lambda data: data.startswith("zodiac_decade_"), parsed),
+        (lambda data: data.startswith("zodiac_year_"), parsed),
+        (lambda data: data.startswith("zodiac_month_"), parsed),
+        (lambda data: data.startswith("zodiac_day_"), parsed),
+    ]
+
+
+def chain_dispatch(chain, data):
+    for predicate, function in chain:
+        if predicate(data):
+            return function(data)
+
+
+def build_router():
+    router = CallbackRouter()
+    for flow in ("mashhad", "kua", "zodiac", "help", "start"):
+        router.route(flow, "button")(handler)
+    router.route("confirm", "join")(handler)
+    for flow in ("kua", "zodiac"):
+        for step in ("decade", "year", "month", "day", "gender"):
+            router.route(flow, step)(handler)
+    return router
+
+
+def router_dispatch(router, data):
+    function, payload = router.resolve(data)
+    return function(payload)
+
+
+def build_chain_bot():
+    bot = AsyncTeleBot("0:benchmark")
+
+    async def noop(call):
+        return call.data.split("_")
+
+    for predicate, _ in build_chain():
+        bot.register_callback_query_handler(noop, func=lambda call, predicate=predicate: predicate(call.data))
+    return bot
+
+
+def build_router_bot():
+    bot = AsyncTeleBot("0:benchmark")
+    router = CallbackRouter()
+
+    async def noop(call, payload):
+        return payload
+
+    for flow in ("mashhad", "kua", "zodiac", "help", "start"):
+        router.route(flow, "button")(noop)
+    router.route("confirm", "join")(noop)
+    for flow in ("kua", "zodiac"):
+        for step in ("decade", "year", "month", "day", "gender"):
+            router.route(flow, step)(noop)
+    router.attach(bot)
+    return bot
+
+
+def bench_bot(label, bot, rounds=2000):
+    calls = [SimpleNamespace(data=data) for data in SAMPLES]
+
+    async def run():
+        started = time.perf_counter()
+        for _ in range(rounds):
+            await bot._process_updates(bot.callback_query_handlers, calls, "callback_query")
+        return time.perf_counter() - started
+
+    seconds = min(asyncio.run(run()) for _ in range(3))
+    per_update = seconds / (rounds * len(calls)) * 1e6
+    print(f"{label:<8} {per_update:8.2f} us/update")
+    return per_update
+
+
+if __name__ == "__main__":
+    print("Predicate matching only")
+    chain, router = build_chain(), build_router()
+    chain = bench("chain", chain_dispatch, [(chain, data) for data in SAMPLES], number=20000, width=8, unit="update")
+    router = bench("router", router_dispatch, [(router, data) for data in SAMPLES], number=20000, width=8, unit="update")
+    print(f"speedup  {chain / router:10.2f}x")
+    print()
+    print("Through AsyncTeleBot update processing")
+    chain = bench_bot("chain", build_chain_bot())
+    router = bench_bot("router", build_router_bot())
+    print(f"speedup  {chain / router:8.2f}x")
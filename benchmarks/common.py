@@ -0,0 +1,17 @@
+"""Timing helper shared by the micro-benchmarks."""
+import timeit
+
+
+
+def bench(label, function, arguments, number=1, repeat=5, width=12, unit="call"):
+    """Print and return the best time in ns of `function(*args)` over `arguments`."""
+    seconds = min(
+        timeit.repeat(
+            lambda: [function(*args) for args in arguments],
+            number=number,
+            repeat=repeat
+        )
+    )
+    per_call = seconds / (number * len(arguments)) * 1e9
+    print(f"{label:<{width}} {per_call:10.1f} ns/{unit}")
+    return per_call
@@ -0,0 +1,347 @@
+"""A local stand-in for the Telegram Bot API, for load tests without Telegram.
+
+Serves /bot<token>/<method> like api.telegram.org. Updates queued with
+`push_update` reach the bot through getUpdates long polling or, once the
+bot calls setWebhook, are POSTed to its webhook. Every message the bot
+sends or edits is recorded per chat, so a load generator can wait for the
+answer to each update. Each method call can be slowed by `latency` (plus
+up to `jitter`) and answered with 429 at random (`throttle_rate`) or when
+more than `rate_limit` messages went out in the last second.
+
+Point the bot at it with BOT_API_URL (see app.py), or run it alone:
+
+    python -m benchmarks.fake_bot_api --port 8081 --latency 0.05
+    BOT_API_URL=http://127.0.0.1:8081 Bot_API_Token=123:fake python app.py
+"""
+import json
+import time
+import random
+import asyncio
+import argparse
+from collections import deque, defaultdict
+from urllib.parse import parse_qsl
+from aiohttp import web, ClientSession, ClientError
+
+
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "HydroCodeBot", "username": "hydrocode_test_bot"}
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+# Methods that count against the message rate limit
+MESSAGE_METHODS = {
+    "sendMessage", "sendPhoto", "sendAudio", "sendDocument", "copyMessage", "forwardMessage",
+    "editMessageText", "editMessageReplyMarkup", "editMessageCaption",
+}
+MEDIA_FIELDS = {"sendPhoto": "photo", "sendAudio": "audio", "sendDocument": "document"}
+
+
+def private_chat(chat_id):
+    return {"id": chat_id, "type": "private", "first_name": f"User{chat_id}"}
+
+
+async def read_params(request):
+    """Form fields of a call; telebot sends a body even with GET, which request.post() skips."""
+    params = dict(request.query)
+    if not request.can_read_body:
+        return params
+    if request.content_type == "multipart/form-data":
+        async for part in await request.multipart():
+            # Uploaded files are read and dropped, only their name is kept
+            params[part.name] = part.filename if part.filename else await part.text()
+            if part.filename:
+                await part.read()
+    else:
+        params.update(parse_qsl((await request.read()).decode()))
+    return params
+
+
+def load_json(value):
+    if value is None or not isinstance(value, str):
+        return value
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+
+class BotEvent:
+    """One message the bot sent or edited, as seen by the user."""
+
+    __slots__ = ("method", "chat_id", "message", "reply_markup", "at")
+
+    def __init__(self, method, chat_id, message, reply_markup):
+        self.method = method
+        self.chat_id = chat_id
+        self.message = message
+        self.reply_markup = reply_markup or {}
+        self.at = time.monotonic()
+
+    def callbacks(self, prefix=""):
+        return [
+            button["callback_data"]
+            for row in self.reply_markup.get("inline_keyboard", [])
+            for button in row
+            if button.get("callback_data", "").startswith(prefix)
+        ]
+
+
+
+class FakeBotApi:
+
+    def __init__(self, latency=0.0, jitter=0.0, throttle_rate=0.0, rate_limit=0, retry_after=1, webhook_workers=16):
+        self.latency = latency
+        self.jitter = jitter
+        self.throttle_rate = throttle_rate
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.webhook_workers = webhook_workers
+        self.webhook_url = None
+        self.webhook_secret = None
+        self.calls = defaultdict(int)
+        self.throttled = 0
+        self.updates_delivered = 0
+        self.get_updates_calls = 0
+        self._update_id = 0
+        self._handed_out = 0
+        self._pending = deque()
+        self._new_updates = asyncio.Event()
+        self._push_queue = asyncio.Queue()
+        self._pushers = []
+        self._sent = deque()
+        self._message_ids = defaultdict(int)
+        self._inboxes = defaultdict(asyncio.Queue)
+        self._file_id = 0
+        self._runner = None
+        self.app = web.Application()
+        self.app.router.add_route("*", "/bot{token}/{method}", self.handle)
+
+    # -------------------------------------------------------------------------
+    # Load generator side
+    # -------------------------------------------------------------------------
+
+    def push_update(self, update):
+        self._update_id += 1
+        update = {"update_id": self._update_id, **update}
+        if self.webhook_url:
+            self._push_queue.put_nowait(update)
+        else:
+            self._pending.append(update)
+            self._new_updates.set()
+        return update["update_id"]
+
+    def inbox(self, chat_id):
+        return self._inboxes[chat_id]
+
+    # -------------------------------------------------------------------------
+    # Bot API side
+    # -------------------------------------------------------------------------
+
+    def _is_throttled(self, method):
+        if method not in MESSAGE_METHODS:
+            return False
+        if self.throttle_rate and random.random() < self.throttle_rate:
+            return True
+        if self.rate_limit:
+            now = time.monotonic()
+            while self._sent and self._sent[0] < now - 1:
+                self._sent.popleft()
+            if len(self._sent) >= self.rate_limit:
+                return True
+            self._sent.append(now)
+        return False
+
+    async def handle(self, request):
+        method = request.match_info["method"]
+        params = await read_params(request)
+        self.calls[method] += 1
+
+        if method != "getUpdates" and (self.latency or self.jitter):
+            await asyncio.sleep(self.latency + random.uniform(0, self.jitter))
+        if self._is_throttled(method):
+            self.throttled += 1
+            return web.json_response({
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            })
+
+        handler = getattr(self, f"api_{method}", None)
+        result = await handler(params) if handler else True
+        return web.json_response({"ok": True, "result": result})
+
+    def _message(self, method, params, **content):
+        chat_id = int(params["chat_id"])
+        self._message_ids[chat_id] += 1
+        message = {
+            "message_id": self._message_ids[chat_id],
+            "date": int(time.time()),
+            "chat": private_chat(chat_id),
+            "from": BOT_USER,
+            **content,
+        }
+        reply_markup = load_json(params.get("reply_markup"))
+        if reply_markup and "inline_keyboard" in reply_markup:
+            # Telegram only echoes inline keyboards back
+            message["reply_markup"] = reply_markup
+        self._inboxes[chat_id].put_nowait(BotEvent(method, chat_id, message, reply_markup))
+        return message
+
+    def _file(self, kind):
+        self._file_id += 1
+        return {"file_id": f"{kind}-{self._file_id}", "file_unique_id": f"u{kind}-{self._file_id}"}
+
+    async def api_getMe(self, params):
+        return BOT_USER
+
+    async def api_getUpdates(self, params):
+        self.get_updates_calls += 1
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        timeout = float(params.get("timeout") or 0)
+        # Updates below the offset are confirmed by the bot
+        while self._pending and self._pending[0]["update_id"] < offset:
+            self._pending.popleft()
+        if not self._pending and timeout:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        updates = list(self._pending)[:limit]
+        # Counted when handed out the first time, a repeated offset resends them
+        self.updates_delivered += sum(1 for update in updates if update["update_id"] > self._handed_out)
+        if updates:
+            self._handed_out = max(self._handed_out, updates[-1]["update_id"])
+        return updates
+
+    async def api_setWebhook(self, params):
+        self.webhook_url = params["url"]
+        self.webhook_secret = params.get("secret_token")
+        # Updates waiting for getUpdates are pushed from now on
+        while self._pending:
+            self._push_queue.put_nowait(self._pending.popleft())
+        if not self._pushers:
+            self._pushers = [asyncio.create_task(self._push_updates()) for _ in range(self.webhook_workers)]
+        return True
+
+    async def api_deleteWebhook(self, params):
+        self.webhook_url = None
+        return True
+
+    async def _push_updates(self):
+        headers = {SECRET_HEADER: self.webhook_secret} if self.webhook_secret else {}
+        async with ClientSession() as session:
+            while True:
+                update = await self._push_queue.get()
+                while True:
+                    try:
+                        async with session.post(self.webhook_url, json=update, headers=headers) as response:
+                            if response.status == 200:
+                                self.updates_delivered += 1
+                                break
+                    except ClientError:
+                        pass
+                    # Like Telegram, retry until the bot accepts it
+                    await asyncio.sleep(0.1)
+
+    async def api_sendMessage(self, params):
+        return self._message("sendMessage", params, text=params.get("text", ""))
+
+    async def api_sendPhoto(self, params):
+        return self._send_media("sendPhoto", params)
+
+    async def api_sendAudio(self, params):
+        return self._send_media("sendAudio", params)
+
+    async def api_sendDocument(self, params):
+        return self._send_media("sendDocument", params)
+
+    def _send_media(self, method, params):
+        kind = MEDIA_FIELDS[method]
+        media = self._file(kind)
+        if kind == "photo":
+            media = [{**media, "width": 512, "height": 512}]
+        elif kind == "audio":
+            media["duration"] = 1
+        return self._message(method, params, caption=params.get("caption"), **{kind: media})
+
+    async def api_copyMessage(self, params):
+        message = self._message("copyMessage", params, text="(copy)")
+        return {"message_id": message["message_id"]}
+
+    async def api_forwardMessage(self, params):
+        return self._message("forwardMessage", params, text="(forward)")
+
+    async def api_editMessageText(self, params):
+        return self._edit("editMessageText", params, text=params.get("text", ""))
+
+    async def api_editMessageReplyMarkup(self, params):
+        return self._edit("editMessageReplyMarkup", params)
+
+    def _edit(self, method, params, **content):
+        chat_id = int(params["chat_id"])
+        message = {
+            "message_id": int(params["message_id"]),
+            "date": int(time.time()),
+            "edit_date": int(time.time()),
+            "chat": private_chat(chat_id),
+            "from": BOT_USER,
+            **content,
+        }
+        reply_markup = load_json(params.get("reply_markup"))
+        if reply_markup and "inline_keyboard" in reply_markup:
+            # Telegram only echoes inline keyboards back
+            message["reply_markup"] = reply_markup
+        self._inboxes[chat_id].put_nowait(BotEvent(method, chat_id, message, reply_markup))
+        return message
+
+    async def api_getChatMember(self, params):
+        return {"status": "member", "user": {"id": int(params["user_id"]), "is_bot": False, "first_name": "User"}}
+
+    async def api_answerCallbackQuery(self, params):
+        return True
+
+    # -------------------------------------------------------------------------
+    # Server
+    # -------------------------------------------------------------------------
+
+    async def start(self, host="127.0.0.1", port=8081):
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        print(f"Fake Bot API on http://{host}:{port}")
+
+    async def stop(self):
+        for task in self._pushers:
+            task.cancel()
+        await asyncio.gather(*self._pushers, return_exceptions=True)
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+
+
+async def serve(args):
+    api = FakeBotApi(
+        latency=args.latency,
+        jitter=args.jitter,
+        throttle_rate=args.throttle_rate,
+        rate_limit=args.rate_limit
+    )
+    await api.start(host=args.host, port=args.port)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await api.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every call")
+    parser.add_argument("--jitter", type=float, default=0.0, help="up to this many extra seconds")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="share of message calls answered with 429")
+    parser.add_argument("--rate-limit", type=int, default=0, help="messages per second before 429, 0 for none")
+    asyncio.run(serve(parser.parse_args()))
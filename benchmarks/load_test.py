@@ -0,0 +1,335 @@
+"""Load test: thousands of simulated users walking the bot's flows against a fake Bot API.
+
+Starts benchmarks/fake_bot_api.py in this process and app.py as a child
+process pointed at it (BOT_API_URL), run from a temporary directory that
+mirrors the checkout and holds a fresh SQLite database. Every user then registers (/start, contact, name,
+city) and walks /kua, /zodiac and /mashhad by pressing the buttons the
+bot actually sent. The latency of a step is the time from queueing the
+update to the bot's answer (the message carrying the next keyboard).
+
+Reports updates/sec, p50/p99 latency and timeouts per step, Bot API calls,
+and the SQL statements and rows the bot wrote during the run (scraped from
+its /metrics), next to the stat counter increments. Run from the
+repository root:
+
+    python -m benchmarks.load_test --users 2000 --ramp 20
+    python -m benchmarks.load_test --mode webhook --latency 0.05 --throttle-rate 0.01
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+from collections import defaultdict
+from aiohttp import ClientSession
+from sqlalchemy import create_engine
+from benchmarks.fake_bot_api import FakeBotApi
+from utils.stats import COUNTERS, get_counters
+
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FLOWS = ("register", "kua", "zodiac", "mashhad")
+# Assets deployed with the bot but not kept in the repository
+PLACEHOLDER_ASSETS = ("data/مهم.m4a",)
+FIRST_USER_ID = 10 ** 9
+TOKEN = "123456:load-test"
+
+
+def has_callback(prefix):
+    return lambda event: bool(event.callbacks(prefix))
+
+
+def asks_for_contact(event):
+    return any(
+        button.get("request_contact")
+        for row in event.reply_markup.get("keyboard", [])
+        for button in row
+    )
+
+
+def removes_keyboard(event):
+    return bool(event.reply_markup.get("remove_keyboard"))
+
+
+def any_message(event):
+    return True
+
+
+# The dashboard closes every flow
+dashboard = has_callback("kua_button")
+
+
+
+class SimulatedUser:
+
+    def __init__(self, api, user_id, results, step_timeout, think):
+        self.api = api
+        self.user_id = user_id
+        self.results = results
+        self.step_timeout = step_timeout
+        self.think = think
+        self.inbox = api.inbox(user_id)
+        self.user = {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"}
+        self.chat = {"id": user_id, "type": "private", "first_name": f"User{user_id}"}
+        self._message_id = 0
+
+    def _message(self, **content):
+        self._message_id += 1
+        return {"message_id": self._message_id, "date": int(time.time()), "chat": self.chat, "from": self.user, **content}
+
+    def text(self, text):
+        content = {"text": text}
+        if text.startswith("/"):
+            content["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return {"message": self._message(**content)}
+
+    def contact(self):
+        phone_number = f"+98912{self.user_id % 10 ** 7:07d}"
+        return {"message": self._message(contact={"phone_number": phone_number, "first_name": "User", "user_id": self.user_id})}
+
+    def press(self, event, data):
+        return {"callback_query": {
+            "id": f"{self.user_id}-{self._message_id}-{data}",
+            "from": self.user,
+            "chat_instance": str(self.user_id),
+            "data": data,
+            "message": event.message,
+        }}
+
+    async def step(self, name, update, expect):
+        """Send `update`, return the first answer matching `expect` (None on timeout)."""
+        while not self.inbox.empty():
+            self.inbox.get_nowait()
+        started = time.monotonic()
+        self.api.push_update(update)
+        deadline = started + self.step_timeout
+        while True:
+            try:
+                event = await asyncio.wait_for(self.inbox.get(), deadline - time.monotonic())
+            except (asyncio.TimeoutError, ValueError):
+                self.results.timeouts[name] += 1
+                return None
+            if expect(event):
+                self.results.latencies[name].append(event.at - started)
+                if self.think:
+                    await asyncio.sleep(random.uniform(0, 2 * self.think))
+                return event
+
+    async def register(self):
+        if not await self.step("register:start", self.text("/start"), asks_for_contact):
+            return False
+        if not await self.step("register:contact", self.contact(), removes_keyboard):
+            return False
+        if not await self.step("register:name", self.text("کاربر آزمایشی"), any_message):
+            return False
+        return bool(await self.step("register:city", self.text(random.choice(["تهران", "مشهد", "شیراز"])), dashboard))
+
+    async def date_wizard(self, flow, steps):
+        event = await self.step(f"{flow}:command", self.text(f"/{flow}"), has_callback(f"{flow}_decade_"))
+        for current, expect in steps:
+            if event is None:
+                return False
+            data = random.choice(event.callbacks(f"{flow}_{current}_"))
+            event = await self.step(f"{flow}:{current}", self.press(event, data), expect)
+        return event is not None
+
+    async def kua(self):
+        return await self.date_wizard("kua", [
+            ("decade", has_callback("kua_year_")),
+            ("year", has_callback("kua_month_")),
+            ("month", has_callback("kua_day_")),
+            ("day", has_callback("kua_gender_")),
+            ("gender", dashboard),
+        ])
+
+    async def zodiac(self):
+        return await self.date_wizard("zodiac", [
+            ("decade", has_callback("zodiac_year_")),
+            ("year", has_callback("zodiac_month_")),
+            ("month", has_callback("zodiac_day_")),
+            ("day", dashboard),
+        ])
+
+    async def mashhad(self):
+        if not await self.step("mashhad:command", self.text("/mashhad"), removes_keyboard):
+            return False
+        if not await self.step("mashhad:name", self.text("کاربر آزمایشی"), any_message):
+            return False
+        return bool(await self.step("mashhad:city", self.text("مشهد"), dashboard))
+
+    async def run(self, flows):
+        for flow in flows:
+            if not await getattr(self, flow)():
+                # The rest depends on being registered, or the user gave up
+                self.results.abandoned[flow] += 1
+                return
+        self.results.completed += 1
+
+
+
+class Results:
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.timeouts = defaultdict(int)
+        self.abandoned = defaultdict(int)
+        self.completed = 0
+
+
+def percentile(values, share):
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+async def scrape_db_metrics(url):
+    """The bot's bot_db_* samples from /metrics, as {(name, kind): value}."""
+    async with ClientSession() as session:
+        async with session.get(url) as response:
+            text = await response.text()
+    samples = defaultdict(float)
+    for line in text.splitlines():
+        if line.startswith("bot_db_"):
+            sample, value = line.rsplit(" ", 1)
+            name, labels = sample.split("{", 1)
+            samples[(name, labels.split('"')[1])] = float(value)
+    return samples
+
+
+def print_report(args, api, results, elapsed, counters, db):
+    updates = api.updates_delivered
+    api_calls = sum(count for method, count in api.calls.items() if method != "getUpdates")
+    print(f"\n{args.users} users, {args.mode}, {elapsed:.1f}s")
+    print(f"Completed: {results.completed}, abandoned: {dict(results.abandoned) or 0}")
+    print(f"Updates: {updates} ({updates / elapsed:.1f}/s)")
+    print(f"Bot API calls: {api_calls} ({api_calls / elapsed:.1f}/s), 429 injected: {api.throttled}")
+    print("  " + ", ".join(f"{method} {count}" for method, count in sorted(api.calls.items(), key=lambda item: -item[1])))
+    print(f"\n{'step':<18}{'count':>7}{'p50 ms':>9}{'p99 ms':>9}{'timeouts':>10}")
+    for name in sorted(set(results.latencies) | set(results.timeouts)):
+        latencies = sorted(results.latencies[name])
+        p50 = f"{percentile(latencies, 0.5) * 1000:.0f}" if latencies else "-"
+        p99 = f"{percentile(latencies, 0.99) * 1000:.0f}" if latencies else "-"
+        print(f"{name:<18}{len(latencies):>7}{p50:>9}{p99:>9}{results.timeouts[name]:>10}")
+    statements = {kind: int(db[("bot_db_statements_total", kind)]) for kind in ("insert", "update", "delete", "select")}
+    writes = statements["insert"] + statements["update"] + statements["delete"]
+    rows = int(sum(value for (name, _), value in db.items() if name == "bot_db_rows_written_total"))
+    print(
+        f"\nDB writes: {writes} statements ({writes / elapsed:.1f}/s), {rows} rows: "
+        + ", ".join(f"{kind} {count}" for kind, count in statements.items() if kind != "select")
+        + f"; {statements['select']} selects ({statements['select'] / elapsed:.1f}/s)"
+    )
+    increments = sum(counters.values())
+    print(f"Stat counter increments: {increments}: " + ", ".join(f"{name} {value}" for name, value in counters.items()))
+
+
+def prepare_workdir(workdir):
+    """Mirror the checkout into `workdir` with symlinks, filling in missing assets.
+
+    The bot reads its data files relative to the working directory, so it
+    runs from here and the checkout itself is left untouched.
+    """
+    for name in os.listdir(ROOT):
+        if name != "data":
+            os.symlink(os.path.join(ROOT, name), os.path.join(workdir, name))
+    os.makedirs(os.path.join(workdir, "data"))
+    for name in os.listdir(os.path.join(ROOT, "data")):
+        os.symlink(os.path.join(ROOT, "data", name), os.path.join(workdir, "data", name))
+    for asset in PLACEHOLDER_ASSETS:
+        path = os.path.join(workdir, asset)
+        if not os.path.exists(path):
+            with open(path, "wb") as file:
+                file.write(b"placeholder")
+
+
+async def wait_for_bot(api, process, mode, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.returncode is not None:
+            raise RuntimeError(f"The bot exited with code {process.returncode}")
+        if (api.webhook_url if mode == "webhook" else api.get_updates_calls):
+            return
+        await asyncio.sleep(0.2)
+    raise RuntimeError("The bot did not start polling or set its webhook in time")
+
+
+async def main(args):
+    workdir = tempfile.mkdtemp(prefix="hydrocode-load-")
+    prepare_workdir(workdir)
+    database = os.path.join(workdir, "load.db")
+    api = FakeBotApi(
+        latency=args.latency,
+        jitter=args.jitter,
+        throttle_rate=args.throttle_rate,
+        rate_limit=args.rate_limit
+    )
+    await api.start(port=args.port)
+
+    env = {
+        **os.environ,
+        "Bot_API_Token": TOKEN,
+        "BOT_API_URL": f"http://127.0.0.1:{args.port}",
+        "BOT_MODE": args.mode,
+        "DATABASE_NAME": database,
+        "STORAGE_BACKEND": "sqlite",
+        "OUTBOUND_RATE": str(args.outbound_rate),
+        "METRICS_PORT": str(args.bot_port + 1),
+    }
+    if args.mode == "webhook":
+        env.update({
+            "WEBHOOK_URL": f"http://127.0.0.1:{args.bot_port}/webhook",
+            "WEBHOOK_SECRET": "load-test",
+            "WEBHOOK_HOST": "127.0.0.1",
+            "WEBHOOK_PORT": str(args.bot_port),
+        })
+    log_path = os.path.join(workdir, "bot.log")
+    with open(log_path, "wb") as log:
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, "app.py", cwd=workdir, env=env, stdout=log, stderr=asyncio.subprocess.STDOUT
+        )
+    print(f"Bot log: {log_path}")
+    metrics_url = f"http://127.0.0.1:{args.bot_port + 1}/metrics"
+    try:
+        await wait_for_bot(api, process, args.mode)
+        # Startup writes (tables, counters) are not part of the run
+        db_before = await scrape_db_metrics(metrics_url)
+        results = Results()
+        flows = [flow for flow in FLOWS if flow in args.flows]
+
+        async def start_user(index):
+            await asyncio.sleep(random.uniform(0, args.ramp))
+            user = SimulatedUser(api, FIRST_USER_ID + index, results, args.step_timeout, args.think)
+            await user.run(flows)
+
+        started = time.monotonic()
+        await asyncio.gather(*(start_user(index) for index in range(args.users)))
+        elapsed = time.monotonic() - started
+        db_after = await scrape_db_metrics(metrics_url)
+        db = {key: db_after[key] - db_before[key] for key in db_after}
+        counters = get_counters(create_engine(f"sqlite:///{database}"), names=COUNTERS)
+        print_report(args, api, results, elapsed, counters, defaultdict(float, db))
+    finally:
+        if process.returncode is None:
+            process.terminate()
+            await process.wait()
+        await api.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--ramp", type=float, default=10.0, help="seconds over which users arrive")
+    parser.add_argument("--think", type=float, default=0.0, help="mean pause between a user's steps")
+    parser.add_argument("--flows", default=",".join(FLOWS), help="comma separated, from " + ", ".join(FLOWS))
+    parser.add_argument("--mode", choices=("polling", "webhook"), default="polling")
+    parser.add_argument("--latency", type=float, default=0.0, help="fake Bot API latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="share of message calls answered with 429")
+    parser.add_argument("--rate-limit", type=int, default=0, help="fake Telegram messages per second, 0 for none")
+    parser.add_argument("--outbound-rate", type=int, default=1000, help="the bot's OUTBOUND_RATE for the run")
+    parser.add_argument("--step-timeout", type=float, default=30.0)
+    parser.add_argument("--port", type=int, default=8081, help="fake Bot API port")
+    parser.add_argument("--bot-port", type=int, default=8090, help="bot webhook port, metrics on the next one")
+    args = parser.parse_args()
+    args.flows = args.flows.split(",")
+    asyncio.run(main(args))
@@ -1,10 +1,15 @@
 from datetime import datetime, timezone
 from typing import Optional
+from sqlalchemy import BigInteger, Integer
 from sqlmodel import SQLModel, Field
 
 
+# Telegram ids do not fit in 32 bits; SQLite keeps INTEGER so user_id stays the rowid
+TelegramId = BigInteger().with_variant(Integer(), "sqlite")
+
+
 class User(SQLModel, table=True):
-    user_id: Optional[int] = Field(primary_key=True)
+    user_id: Optional[int] = Field(primary_key=True, sa_type=TelegramId)
     username: Optional[str]
     phone_number: Optional[str]
     first_name: Optional[str]
@@ -15,7 +20,7 @@ class User(SQLModel, table=True):
 
 
 class Kua(SQLModel, table=True):
-    user_id: Optional[int] = Field(primary_key=True)
+    user_id: Optional[int] = Field(primary_key=True, sa_type=TelegramId)
     gender: Optional[str]
     birth_date: Optional[str]
     kua_number: Optional[str]
@@ -23,7 +28,7 @@ class Kua(SQLModel, table=True):
 
 
 class Zodiac(SQLModel, table=True):
-    user_id: Optional[int] = Field(primary_key=True)
+    user_id: Optional[int] = Field(primary_key=True, sa_type=TelegramId)
     birth_date: Optional[str]
     chinese_sign: Optional[str]
     chinese_element: Optional[str]
@@ -31,7 +36,43 @@ class Zodiac(SQLModel, table=True):
 
 
 class Mashhad(SQLModel, table=True):
-    user_id: Optional[int] = Field(primary_key=True)
+    user_id: Optional[int] = Field(primary_key=True, sa_type=TelegramId)
     name: Optional[str]
     city: Optional[str]
     create_date: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+
+class Media(SQLModel, table=True):
+    path: str = Field(primary_key=True)
+    content_hash: str = Field(primary_key=True)
+    kind: Optional[str]
+    file_id: Optional[str]
+    create_date: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+
+class Broadcast(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    kind: str
+    payload: str
+    chat_id: Optional[int] = Field(sa_type=TelegramId)
+    status: str = "running"
+    cursor: Optional[int] = Field(default=None, sa_type=TelegramId)
+    total: int = 0
+    sent: int = 0
+    failed: int = 0
+    # The process delivering it, until lease_until (epoch seconds) passes without a checkpoint
+    owner: Optional[str] = None
+    lease_until: float = 0.0
+    create_date: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    update_date: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+
+class StatCounter(SQLModel, table=True):
+    name: str = Field(primary_key=True)
+    value: int = 0
+
+
+class ConversationState(SQLModel, table=True):
+    user_id: Optional[int] = Field(primary_key=True, sa_type=TelegramId)
+    data: str
+    expires_at: float = Field(index=True)
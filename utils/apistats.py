@@ -0,0 +1,115 @@
+import os
+import time
+from telebot import asyncio_helper
+from telebot.asyncio_helper import ApiTelegramException
+from utils.metrics import current_handler
+from utils.ratelimit import get_retry_after
+
+
+
+def file_size(file):
+    if isinstance(file, tuple):
+        # (file_name, file) pairs
+        file = file[-1]
+    if isinstance(file, (bytes, bytearray)):
+        return len(file)
+    file = getattr(file, "file", file)
+    try:
+        return os.fstat(file.fileno()).st_size
+    except (AttributeError, OSError, ValueError):
+        return 0
+
+
+def payload_size(params, files):
+    """Approximate request size: parameter values as text plus uploaded file sizes."""
+    size = sum(len(str(value)) for value in (params or {}).values() if value is not None)
+    return size + sum(file_size(file) for file in (files or {}).values())
+
+
+
+class ApiCallStats:
+    """Count, latency, payload bytes and 429s of every Bot API call, per method.
+
+    Installed by swapping telebot's `asyncio_helper._process_request`, the
+    single function every AsyncTeleBot method goes through. Calls are also
+    attributed to the handler that made them through `current_handler`,
+    which BotMetrics sets around every handler; calls outside any handler
+    (broadcasts, startup) count as "background".
+    """
+
+    def __init__(self, metrics):
+        registry = metrics.registry
+        self.calls = registry.counter(
+            "bot_api_calls_total", "Bot API calls by method and calling handler.", ["method", "handler"]
+        )
+        self.latency = registry.histogram(
+            "bot_api_latency_seconds", "Bot API call latency.", ["method"]
+        )
+        self.payload_bytes = registry.counter(
+            "bot_api_payload_bytes_total", "Approximate bytes sent to the Bot API.", ["method"]
+        )
+        self.errors = registry.counter(
+            "bot_api_errors_total", "Failed Bot API calls by error code or exception type.", ["method", "error"]
+        )
+        self.throttled = registry.counter(
+            "bot_api_throttled_total", "Bot API calls answered with 429.", ["method"]
+        )
+        self.retry_after = registry.counter(
+            "bot_api_retry_after_seconds_total", "Seconds of retry_after requested by 429 answers.", ["method"]
+        )
+        self._original = None
+
+    def install(self):
+        if self._original is not None:
+            return
+        self._original = asyncio_helper._process_request
+        asyncio_helper._process_request = self._process_request
+
+    def uninstall(self):
+        if self._original is not None:
+            asyncio_helper._process_request = self._original
+            self._original = None
+
+    async def _process_request(self, token, url, method="get", params=None, files=None, **kwargs):
+        self.calls.inc(url, current_handler.get())
+        self.payload_bytes.inc(url, amount=payload_size(params, files))
+        started = time.perf_counter()
+        try:
+            return await self._original(token, url, method=method, params=params, files=files, **kwargs)
+        except ApiTelegramException as e:
+            retry_after = get_retry_after(e)
+            if retry_after is not None:
+                self.throttled.inc(url)
+                self.retry_after.inc(url, amount=retry_after)
+            self.errors.inc(url, str(e.error_code))
+            raise
+        except Exception as e:
+            self.errors.inc(url, type(e).__name__)
+            raise
+        finally:
+            self.latency.observe(time.perf_counter() - started, url)
+
+    def summary(self, top_handlers=3):
+        latency = self.latency.samples()
+        if not latency:
+            return "No Bot API calls yet."
+        payload_bytes = self.payload_bytes.samples()
+        throttled = self.throttled.samples()
+        retry_after = self.retry_after.samples()
+        errors = {}
+        for (method, _), count in self.errors.samples().items():
+            errors[method] = errors.get(method, 0) + count
+        handlers = {}
+        for (method, handler), count in self.calls.samples().items():
+            handlers.setdefault(method, []).append((count, handler))
+
+        lines = []
+        for (method,), (_, total, count) in sorted(latency.items(), key=lambda item: -item[1][2]):
+            lines.append(
+                f"{method}: {count} calls, {total / count * 1000:.0f} ms avg, "
+                f"{payload_bytes.get((method,), 0) / 1024:.1f} KB, {errors.get(method, 0)} errors, "
+                f"{throttled.get((method,), 0)} x 429 ({retry_after.get((method,), 0)}s)"
+            )
+            busiest = sorted(handlers.get(method, []), reverse=True)[:top_handlers]
+            lines.append("  " + ", ".join(f"{handler} {count}" for count, handler in busiest))
+        return "\n".join(lines)
@@ -1,10 +1,14 @@
 import asyncio
 import datetime
-import lunardate
-from sqlmodel import SQLModel, create_engine, Session, select, text
-from utils import jalali
+from sqlmodel import SQLModel, create_engine, Session, select, update, func
+from utils.database import dialect_insert
+from utils.stats import increment_counters, registration_counter
+from utils import jalali, lunar
 from models import User, Kua, Zodiac, Mashhad
+from utils.membership import MembershipResult, FAIL_CLOSED
+from utils.keyboards import keyboards
 from telebot.async_telebot import AsyncTeleBot
+from telebot.asyncio_helper import ApiTelegramException
 from telebot.types import (
     InlineKeyboardMarkup,
     InlineKeyboardButton,
@@ -74,7 +78,7 @@ CHINESE_ELEMENTS_FARSI = {
 }
 
 
-def dashboard_keyboard():
+def build_dashboard_keyboard():
     markup = InlineKeyboardMarkup()
     markup.add(
         InlineKeyboardButton(text="ثبت نام سفر مشهد", callback_data="mashhad_button"),
@@ -94,23 +98,45 @@ def dashboard_keyboard():
     return markup
 
 
-async def is_user_member(bot, user_id, channels):
-    remaining_channels = []
-    try:
-        for cid in channels:
-            member = await bot.get_chat_member(
-                chat_id=f"@{cid}",
-                user_id=user_id
-            )
-            if member.status not in ['member', 'administrator', 'creator']:
-                remaining_channels.append(cid)
-    except Exception as e:
-        print(f"Error Checking Membership: {e}")
-    return len(remaining_channels) == 0, remaining_channels
+def dashboard_keyboard():
+    return keyboards.get(("dashboard",), build_dashboard_keyboard)
 
 
+async def get_channel_membership(bot, user_id, channel):
+    member = await bot.get_chat_member(
+        chat_id=f"@{channel}",
+        user_id=user_id
+    )
+    return member.status in ['member', 'administrator', 'creator']
+
+
+async def is_user_member(bot, user_id, channels, cache=None, timeout=None, failure_policy=FAIL_CLOSED):
+    async def check(cid):
+        def fetch():
+            return get_channel_membership(bot, user_id, cid)
+        lookup = fetch() if cache is None else cache.get_or_fetch(user_id, cid, fetch)
+        return await asyncio.wait_for(lookup, timeout)
+
+    results = await asyncio.gather(*(check(cid) for cid in channels), return_exceptions=True)
+    confirmed, missing, failed = [], [], []
+    for cid, result in zip(channels, results):
+        if isinstance(result, BaseException):
+            print(f"Error Checking Membership ({cid}): {result!r}")
+            failed.append(cid)
+        elif result:
+            confirmed.append(cid)
+        else:
+            missing.append(cid)
+    return MembershipResult(
+        confirmed=confirmed,
+        missing=missing,
+        failed=failed,
+        failure_policy=failure_policy
+    )
 
-async def send_join_channel_button(bot, chat_id, channels):
+
+
+def build_join_channel_keyboard(channels):
     markup = InlineKeyboardMarkup()
     for cu in channels:
         if cu == "helekhobmalkhob":
@@ -130,7 +156,11 @@ async def send_join_channel_button(bot, chat_id, channels):
         callback_data="confirm_join"
     )
     markup.add(confirm_button)
+    return markup
+
 
+async def send_join_channel_button(bot, chat_id, channels):
+    markup = keyboards.get(("join", tuple(channels)), build_join_channel_keyboard, channels)
     await bot.send_message(
         chat_id=chat_id,
         text=(
@@ -143,297 +173,481 @@ async def send_join_channel_button(bot, chat_id, channels):
 
 
 
-async def user_channel_check(engine, table, bot, message, user_id, max_visit, channels):
-    with Session(engine) as session:
-        statement = select(table).where(table.user_id == user_id)
-        user = session.exec(statement).first()
-        is_member, rm_channels = await is_user_member(bot=bot, user_id=user_id, channels=channels)
-        # if user and\
-        #     user.count_visit >= max_visit and\
-        #         not is_member:
-        if not is_member:
-            await send_join_channel_button(
-                bot=bot,
-                chat_id=message.chat.id,
-                channels=rm_channels
-            )
-            return False
-        return True
+async def user_channel_check(
+    bot, message, user_id, channels,
+    cache=None, timeout=None, failure_policy=FAIL_CLOSED
+):
+    is_member, rm_channels = await is_user_member(
+        bot=bot,
+        user_id=user_id,
+        channels=channels,
+        cache=cache,
+        timeout=timeout,
+        failure_policy=failure_policy
+    )
+    if not is_member:
+        await send_join_channel_button(
+            bot=bot,
+            chat_id=message.chat.id,
+            channels=rm_channels
+        )
+        return False
+    return True
+
+
 
+TEXT_BACK = "🔙 بازگشت"
 
 
-def create_inline_keyboard(options, columns=3, callback_prefix="option_"):
-    """Generate inline keyboards with flexible column layout."""
+def create_inline_keyboard(options, columns=3, callback_prefix="option_", back_data=None):
+    """Generate inline keyboards with flexible column layout, plus an optional back row."""
     markup = InlineKeyboardMarkup()
+    label = PERSIAN_MONTHS.__getitem__ if "month" in callback_prefix else str
     row = []
     for i, option in enumerate(options):
         row.append(
             InlineKeyboardButton(
-                text=PERSIAN_MONTHS[option] if "month" in callback_prefix else str(option),
+                text=label(option),
                 callback_data=f"{callback_prefix}{option}")
             )
         if len(row) == columns or i == len(options) - 1:
             markup.add(*row)
             row = []
+    if back_data:
+        markup.add(InlineKeyboardButton(text=TEXT_BACK, callback_data=back_data))
     return markup
 
 
 
+GENDER_WORDS = {
+    "male": "male",
+    "m": "male",
+    "مرد": "male",
+    "female": "female",
+    "f": "female",
+    "زن": "female",
+}
+
+
+def parse_birth_input(text):
+    """'1370/5/3 male' -> ((1370, 5, 3), 'male'), the gender is None when left out.
+
+    Raises ValueError when the date can not be read or does not exist.
+    """
+    tokens = text.split()
+    gender = None
+    if tokens and tokens[-1].lower() in GENDER_WORDS:
+        gender = GENDER_WORDS[tokens.pop().lower()]
+    return jalali.parse_persian_date(" ".join(tokens)), gender
+
+
+
 def is_valid_date(
     year: int,
     month: int,
     day: int
 ) -> bool:
-    try:
-        jalali.Persian((year, month, day)).gregorian_tuple()
-        # datetime(year, month, day)
-        return True
-    except ValueError:
-        return False
+    return jalali.is_valid_persian(year, month, day)
 
 
 
 def extract_chinese_year(
-        date_string: str
+        date
     ) -> int:
-    date = datetime.datetime.strptime(date_string, "%Y-%m-%d")
-    lunar_date = lunardate.LunarDate.fromSolarDate(date.year, date.month, date.day)
-    return int(lunar_date.year)
+    # A datetime.date or a (year, month, day) tuple, "YYYY-MM-DD" still works
+    if isinstance(date, str):
+        date = datetime.date.fromisoformat(date)
+    return lunar.chinese_year(date)
 
 
+def chinese_zodiac(
+        date
+    ) -> tuple:
+    """(lunar year, sign, element) of a Gregorian birth date.
 
-def calculate_kua_number(
-    kua_data,
+    Births before Chinese New Year belong to the previous lunar year, so
+    sign and element both follow the lunar year, not the Gregorian one.
+    """
+    chinese_year = extract_chinese_year(date)
+    return chinese_year, CHINESE_SIGNS[chinese_year % 12], CHINESE_ELEMENTS[chinese_year % 10 // 2]
+
+
+
+class YearTable:
+    """Small positive integers indexed by (column, year - base).
+
+    Compiled once from kua.json, which maps str(year) to a value per
+    column, so a lookup is one bytes index instead of formatting the year
+    as a string. 0 marks a year missing from the dataset and `get` returns
+    None for it, callers fall back to the formula then.
+    """
+
+    __slots__ = ("base", "span", "data")
+
+    def __init__(self, *columns):
+        years = [int(year) for column in columns for year in column]
+        self.base = min(years)
+        self.span = max(years) - self.base + 1
+        data = bytearray(self.span * len(columns))
+        for index, column in enumerate(columns):
+            for year, value in column.items():
+                data[index * self.span + int(year) - self.base] = value
+        self.data = bytes(data)
+
+    def get(self, year, column=0):
+        offset = year - self.base
+        if 0 <= offset < self.span:
+            return self.data[column * self.span + offset] or None
+
+
+KUA_GENDERS = ("male", "female")
+KUA_COLUMNS = {gender: column for column, gender in enumerate(KUA_GENDERS)}
+
+
+def compile_kua_table(kua_data):
+    return YearTable(*(kua_data[gender] for gender in KUA_GENDERS))
+
+
+def kua_formula(
     birth_year: int,
     gender: str
 ) -> int:
-    
-    kua_number = kua_data.get(gender, {}).get(str(birth_year), None)
-    
-    # year_sum = sum(map(int, str(birth_year)[-2:]))
-
-    # while year_sum > 9:
-    #     year_sum = sum(map(int, str(year_sum)))
-    
-    # kua_number = 0
-
-    # if gender.lower() == "male":
-    #     kua_number = 10 - year_sum
-    #     kua_number = 9 if kua_number == 0 else (2 if kua_number == 5 else kua_number)
-    # elif gender.lower() == "female":
-    #     kua_number = year_sum + 5
-    #     kua_number = sum(map(int, str(kua_number))) if kua_number > 9 else kua_number
-    #     kua_number = 9 if kua_number == 0 else (8 if kua_number == 5 else kua_number)
+    year_sum = sum(map(int, str(birth_year)[-2:]))
+
+    while year_sum > 9:
+        year_sum = sum(map(int, str(year_sum)))
+
+    if gender == "male":
+        # Births from 2000 on count from 9 instead of 10
+        kua_number = (10 if birth_year < 2000 else 9) - year_sum
+        kua_number = 9 if kua_number == 0 else (2 if kua_number == 5 else kua_number)
+    elif gender == "female":
+        # ... and add 6 instead of 5
+        kua_number = year_sum + (5 if birth_year < 2000 else 6)
+        kua_number = sum(map(int, str(kua_number))) if kua_number > 9 else kua_number
+        kua_number = 8 if kua_number == 5 else kua_number
+    else:
+        raise ValueError(f"Unknown gender: {gender}")
 
     return kua_number
 
-def calculate_zodiac_animal(
-    zodiac_animal_dataset,
+
+def calculate_kua_number(
+    kua_table,
     birth_year: int,
+    gender: str
 ) -> int:
-    
-    zodiac_animal = zodiac_animal_dataset.get(str(birth_year), None)
-    
-    # year_sum = sum(map(int, str(birth_year)[-2:]))
+    column = KUA_COLUMNS.get(gender)
+    if column is None:
+        raise ValueError(f"Unknown gender: {gender}")
+    return kua_table.get(birth_year, column) or kua_formula(birth_year, gender)
 
-    # while year_sum > 9:
-    #     year_sum = sum(map(int, str(year_sum)))
-    
-    # kua_number = 0
 
-    # if gender.lower() == "male":
-    #     kua_number = 10 - year_sum
-    #     kua_number = 9 if kua_number == 0 else (2 if kua_number == 5 else kua_number)
-    # elif gender.lower() == "female":
-    #     kua_number = year_sum + 5
-    #     kua_number = sum(map(int, str(kua_number))) if kua_number > 9 else kua_number
-    #     kua_number = 9 if kua_number == 0 else (8 if kua_number == 5 else kua_number)
 
-    return zodiac_animal
 
+async def send_or_edit(bot, chat_id, text, reply_markup=None, message_id=None):
+    """Send a new message, or with `message_id` rewrite that message in place."""
+    if message_id is None:
+        return await bot.send_message(chat_id=chat_id, text=text, reply_markup=reply_markup)
+    try:
+        return await bot.edit_message_text(
+            text=text,
+            chat_id=chat_id,
+            message_id=message_id,
+            reply_markup=reply_markup
+        )
+    except ApiTelegramException as e:
+        # A double tap renders the same step twice
+        if "message is not modified" not in e.description:
+            raise
 
 
-async def decade_buttons(bot, chat_id, callback_prefix="decade_"):
-    decades = [f"{year}" for year in range(1320, 1420, 10)]
-    markup = create_inline_keyboard(
-        options=decades,
+
+DECADES = tuple(range(1320, 1420, 10))
+
+
+async def decade_buttons(bot, chat_id, callback_prefix="decade_", message_id=None):
+    markup = keyboards.get(
+        ("decade", callback_prefix),
+        create_inline_keyboard,
+        options=DECADES,
         columns=2,
         callback_prefix=callback_prefix
     )
-    await bot.send_message(
+    await send_or_edit(
+        bot=bot,
         chat_id=chat_id,
         text="لطفاً دهه سال تولد خود را انتخاب کنید:",
-        reply_markup=markup
+        reply_markup=markup,
+        message_id=message_id
     )
 
 
 
-async def year_buttons(bot, chat_id, start_year, end_year, callback_prefix="year_"):
-    years = range(start_year, end_year + 1)
-    markup = create_inline_keyboard(
-        options=years,
+async def year_buttons(
+    bot, chat_id, start_year, end_year, callback_prefix="year_", message_id=None, back_data=None
+):
+    markup = keyboards.get(
+        ("year", callback_prefix, start_year, end_year, back_data),
+        create_inline_keyboard,
+        options=range(start_year, end_year + 1),
         columns=3,
-        callback_prefix=callback_prefix
+        callback_prefix=callback_prefix,
+        back_data=back_data
     )
-    await bot.send_message(
-        chat_id=chat_id, 
+    await send_or_edit(
+        bot=bot,
+        chat_id=chat_id,
         text="لطفاً سال تولد خود را انتخاب کند:",
-        reply_markup=markup
+        reply_markup=markup,
+        message_id=message_id
     )
 
 
 
-async def month_buttons(bot, chat_id, callback_prefix="month_"):
-    months = range(1, 13)
-    markup = create_inline_keyboard(
-        options=months,
+async def month_buttons(bot, chat_id, callback_prefix="month_", message_id=None, back_data=None):
+    markup = keyboards.get(
+        ("month", callback_prefix, back_data),
+        create_inline_keyboard,
+        options=range(1, 13),
         columns=3,
-        callback_prefix=callback_prefix
+        callback_prefix=callback_prefix,
+        back_data=back_data
     )
-    await bot.send_message(
-        chat_id=chat_id, 
-        text="لطفاً ماه تولد خود را انتخاب کنید:", 
-        reply_markup=markup
+    await send_or_edit(
+        bot=bot,
+        chat_id=chat_id,
+        text="لطفاً ماه تولد خود را انتخاب کنید:",
+        reply_markup=markup,
+        message_id=message_id
     )
 
 
 
-async def day_buttons(bot, chat_id, callback_prefix="day_"):
-    days = range(1, 32)
-    markup = create_inline_keyboard(
-        options=days,
-        columns=3, 
-        callback_prefix=callback_prefix
+async def day_buttons(bot, chat_id, callback_prefix="day_", message_id=None, back_data=None, days=31):
+    # `days` is the length of the chosen month, so impossible dates are never offered
+    markup = keyboards.get(
+        ("day", callback_prefix, days, back_data),
+        create_inline_keyboard,
+        options=range(1, days + 1),
+        columns=3,
+        callback_prefix=callback_prefix,
+        back_data=back_data
     )
-    await bot.send_message(
-        chat_id=chat_id, 
+    await send_or_edit(
+        bot=bot,
+        chat_id=chat_id,
         text="لطفاً روز تولد خود را انتخاب کنید:",
-        reply_markup=markup
+        reply_markup=markup,
+        message_id=message_id
     )
 
 
 
-async def gender_buttons(bot, chat_id, callback_prefix="gender_"):
+def build_gender_keyboard(callback_prefix="gender_", back_data=None):
     markup = InlineKeyboardMarkup()
     markup.add(
         InlineKeyboardButton("مرد", callback_data=callback_prefix + "male"),
         InlineKeyboardButton("زن", callback_data=callback_prefix + "female")
     )
-    await bot.send_message(
-        chat_id=chat_id, 
+    if back_data:
+        markup.add(InlineKeyboardButton(text=TEXT_BACK, callback_data=back_data))
+    return markup
+
+
+async def gender_buttons(bot, chat_id, callback_prefix="gender_", message_id=None, back_data=None):
+    markup = keyboards.get(
+        ("gender", callback_prefix, back_data),
+        build_gender_keyboard,
+        callback_prefix,
+        back_data
+    )
+    await send_or_edit(
+        bot=bot,
+        chat_id=chat_id,
         text="لطفاً جنسیت خود را انتخاب کنید:",
-        reply_markup=markup
+        reply_markup=markup,
+        message_id=message_id
     )
 
 
 
+def upsert_and_increment_visit(engine, table, user_id, values, max_calculation, counter=None):
+    """Store `values` and count one more visit, in a single statement.
+
+    INSERT ... ON CONFLICT (user_id) DO UPDATE SET ..., count_visit = count_visit + 1
+    WHERE count_visit < :max_calculation RETURNING count_visit
+
+    The quota check and the increment are atomic, so a double tap can not
+    exceed `max_calculation`. Returns the new count_visit, or None when the
+    user has already used up the quota (nothing is written then). A stored
+    visit also bumps the `counter` stat in the same transaction.
+    """
+    if max_calculation < 1:
+        return None
+    statement = dialect_insert(engine, table).values(user_id=user_id, count_visit=1, **values)
+    count_visit = func.coalesce(table.count_visit, 0)
+    statement = statement.on_conflict_do_update(
+        index_elements=[table.user_id],
+        set_={
+            **{column: statement.excluded[column] for column in values},
+            "count_visit": count_visit + 1,
+        },
+        where=count_visit < max_calculation
+    ).returning(table.count_visit)
+    with Session(engine) as session:
+        result = session.exec(statement).scalar()
+        if result is not None and counter:
+            increment_counters(session, engine, {counter: 1})
+        session.commit()
+    return result
+
+
+def release_visit(engine, table, user_id, counter=None):
+    """Give back one visit counted by `upsert_and_increment_visit`.
+
+    Used when the result could not be delivered. The decrement is
+    conditional (count_visit > 0), so a /reset in between can not push it
+    below zero, and the `counter` stat only follows a row that changed.
+    Returns whether a visit was given back.
+    """
+    with Session(engine) as session:
+        result = session.exec(
+            update(table)
+            .where(table.user_id == user_id, table.count_visit > 0)
+            .values(count_visit=table.count_visit - 1)
+        )
+        released = result.rowcount == 1
+        if released and counter:
+            increment_counters(session, engine, {counter: -1})
+        session.commit()
+    return released
+
+
 def insert_to_kua_table(
-    engine, user_id, gender, birth_date, kua_number, count_visit
+    engine, user_id, gender, birth_date, kua_number, max_calculation
 ):
-    tmp = Kua(
+    return upsert_and_increment_visit(
+        engine=engine,
+        table=Kua,
         user_id=user_id,
-        gender=gender,
-        birth_date=birth_date,
-        kua_number=kua_number,
-        count_visit=count_visit
+        values={
+            "gender": gender,
+            "birth_date": birth_date,
+            "kua_number": kua_number,
+        },
+        max_calculation=max_calculation,
+        counter="kua_calculations"
     )
-    with Session(engine) as session:
-        session.merge(tmp)
-        session.commit()
 
 
 def insert_to_zodiac_table(
-    engine, user_id, birth_date, chinese_sign, chinese_element, count_visit
+    engine, user_id, birth_date, chinese_sign, chinese_element, max_calculation
 ):
-    tmp = Zodiac(
+    return upsert_and_increment_visit(
+        engine=engine,
+        table=Zodiac,
         user_id=user_id,
-        birth_date=birth_date,
-        chinese_sign=chinese_sign,
-        chinese_element=chinese_element,
-        count_visit=count_visit
+        values={
+            "birth_date": birth_date,
+            "chinese_sign": chinese_sign,
+            "chinese_element": chinese_element,
+        },
+        max_calculation=max_calculation,
+        counter="zodiac_calculations"
+    )
+
+
+def insert_or_update(engine, table, values, deltas, keep=()):
+    """Insert the row for values["user_id"], or update it when it exists.
+
+    INSERT ... ON CONFLICT (user_id) DO NOTHING RETURNING user_id tells in
+    the same statement whether this call created the row, so `deltas` are
+    counted once even when two inserts for a new user race. An existing row
+    gets every value except the `keep` columns.
+    """
+    statement = (
+        dialect_insert(engine, table)
+        .values(**values)
+        .on_conflict_do_nothing(index_elements=[table.user_id])
+        .returning(table.user_id)
     )
     with Session(engine) as session:
-        session.merge(tmp)
+        if session.exec(statement).scalar() is not None:
+            increment_counters(session, engine, deltas)
+        else:
+            session.exec(
+                update(table)
+                .where(table.user_id == values["user_id"])
+                .values(**{column: value for column, value in values.items() if column not in ("user_id", *keep)})
+            )
         session.commit()
 
 
 def insert_to_user_table(
     engine, user_id, username, phone_number, first_name, last_name, given_name, city
 ):
-    tmp = User(
-        user_id=user_id,
-        username=username,
-        phone_number=phone_number,
-        first_name=first_name,
-        last_name=last_name,
-        given_name=given_name,
-        city=city,
+    create_date = datetime.datetime.now(datetime.timezone.utc)
+    insert_or_update(
+        engine=engine,
+        table=User,
+        values={
+            "user_id": user_id,
+            "username": username,
+            "phone_number": phone_number,
+            "first_name": first_name,
+            "last_name": last_name,
+            "given_name": given_name,
+            "city": city,
+            "create_date": create_date,
+        },
+        deltas={"users": 1, registration_counter(create_date): 1},
+        # The registration is counted on its first day, rebuild_counters agrees then
+        keep=("create_date",)
     )
-    with Session(engine) as session:
-        session.merge(tmp)
-        session.commit()
 
 
 def insert_to_mashhad_table(
     engine, user_id, name, city
 ):
-    tmp = Mashhad(
-        user_id=user_id,
-        name=name,
-        city=city,
+    insert_or_update(
+        engine=engine,
+        table=Mashhad,
+        values={
+            "user_id": user_id,
+            "name": name,
+            "city": city,
+            "create_date": datetime.datetime.now(datetime.timezone.utc),
+        },
+        deltas={"mashhad": 1}
     )
+
+
+def get_all_rows(engine, table):
     with Session(engine) as session:
-        session.merge(tmp)
+        return session.exec(select(table)).all()
+
+
+def reset_count_visit(engine, tables):
+    with Session(engine) as session:
+        for table in tables:
+            session.exec(update(table).values(count_visit=0))
         session.commit()
 
 
-def check_visit_count(engine, table, user_id, max_calculation):
+def get_all_user_ids(engine, table):
     with Session(engine) as session:
-        statement = select(table).where(table.user_id == user_id)
-        user = session.exec(statement).first()
-        if user and user.count_visit >= max_calculation:
-            return False
-        return True
+        return session.exec(select(table.user_id)).all()
 
 
-def check_register(engine, table, user_id):
+def get_user_ids_after(engine, table, cursor, limit):
+    statement = select(table.user_id).order_by(table.user_id).limit(limit)
+    if cursor is not None:
+        statement = statement.where(table.user_id > cursor)
     with Session(engine) as session:
-        statement = select(table).where(table.user_id == user_id)
-        user = session.exec(statement).first()
-        if user:
-            return False
-        return True
+        return session.exec(statement).all()
 
 
-def get_all_user_ids(engine, table):
+def count_rows(engine, table):
     with Session(engine) as session:
-        result = session.exec(text(f"SELECT user_id FROM {table}"))
-    return [row[0] for row in result.fetchall()]
-
-
-async def send_message_to_all_users(engine, table, bot, message_text):
-    user_ids = get_all_user_ids(engine=engine, table=table)
-    for user_id in user_ids:
-        try:
-            await bot.send_message(
-                chat_id=user_id,
-                text=message_text,
-                parse_mode="HTML"
-            )
-            await asyncio.sleep(0.3)
-        except Exception as e:
-            print(f"Failed to send message to {user_id}: {e}")
-
-
-async def forward_message_to_all_users(engine, table, bot, from_chat_id, message_id):
-    user_ids = get_all_user_ids(engine=engine, table=table)
-    for user_id in user_ids:
-        try:
-            await bot.copy_message(
-                user_id,
-                from_chat_id,
-                message_id
-            )
-            await asyncio.sleep(0.1)
-        except Exception as e:
-            print(f"Failed to forward message to {user_id}: {e}")
+        return session.exec(select(func.count()).select_from(table)).one()
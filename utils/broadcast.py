@@ -0,0 +1,306 @@
+import os
+import json
+import time
+import uuid
+import socket
+import asyncio
+from collections import deque
+from datetime import datetime, timezone
+from sqlmodel import Session, select, update
+from models import Broadcast
+from utils.database import run_db
+from utils.metrics import current_handler, current_chat
+from utils.outbound import outbound_lane, LANE_BULK
+from utils.ratelimit import get_retry_after
+from telebot.asyncio_helper import ApiTelegramException
+
+
+
+BROADCAST_RUNNING = "running"
+BROADCAST_DONE = "done"
+
+
+
+class LeaseLost(Exception):
+    """Another process took over the broadcast after our lease expired."""
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    if hours:
+        return f"{hours}h {minutes}m"
+    if minutes:
+        return f"{minutes}m {seconds}s"
+    return f"{seconds}s"
+
+
+
+class BroadcastProgress:
+    """In-memory throughput figures of a running broadcast."""
+
+    def __init__(self, job):
+        self.job_id = job.id
+        self.kind = job.kind
+        self.total = job.total
+        self.sent = job.sent
+        self.failed = job.failed
+        self.started = time.monotonic()
+        self.done_at_start = job.sent + job.failed
+
+    @property
+    def done(self):
+        return self.sent + self.failed
+
+    @property
+    def rate(self):
+        elapsed = time.monotonic() - self.started
+        return (self.done - self.done_at_start) / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def eta(self):
+        rate = self.rate
+        remaining = max(self.total - self.done, 0)
+        return remaining / rate if rate > 0 else None
+
+    def summary(self):
+        eta = self.eta
+        return (
+            f"Broadcast #{self.job_id} ({self.kind})\n"
+            f"Sent: {self.sent} / {self.total}, Failed: {self.failed}\n"
+            f"Rate: {self.rate:.1f} msg/s, ETA: {format_duration(eta) if eta is not None else '-'}"
+        )
+
+
+
+class BroadcastEngine:
+    """Background, resumable delivery of one message to every user.
+
+    Recipients come from `storage` and are walked in `user_id` order in
+    batches of `batch_size`. Each batch is drained by `workers` concurrent
+    senders. Pacing is left to the installed OutboundScheduler: the sends
+    run in its bulk lane, which holds the global and per-chat limits and
+    pauses every lane on a 429, so a send that got one is simply tried
+    again, up to `max_retries` times. After each batch the last user_id is
+    checkpointed in the `broadcast` table of `storage.engine`, so after a
+    crash `resume_pending()` continues from there (at most one batch may be
+    delivered twice).
+
+    Several bot processes may share that table. A job is leased to the
+    process delivering it (`owner`, `lease_until`), the lease is renewed at
+    every checkpoint, and another process only takes a job over with an
+    atomic UPDATE once the lease has expired. `watch()` does that
+    periodically, so a job left by a crashed replica is picked up by another.
+
+    Supported kinds and their payloads:
+        copy:  {"from_chat_id": ..., "message_id": ...}
+        text:  {"text": ..., "parse_mode": ...}
+        photo: {"path": ..., "caption": ..., "parse_mode": ...} (needs `media`)
+    """
+
+    def __init__(
+        self, storage, bot, media=None,
+        workers=8, batch_size=500, max_retries=5, lease_seconds=120
+    ):
+        self.storage = storage
+        self.engine = storage.engine
+        self.bot = bot
+        self.media = media
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        # Longer than a batch takes, a checkpoint renews it
+        self.lease_seconds = lease_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.progress = {}
+        self._tasks = {}
+
+    # -------------------------------------------------------------------------
+    # Persistence
+    # -------------------------------------------------------------------------
+
+    def _create_job(self, kind, payload, chat_id):
+        total = self.storage.count_users()
+        with Session(self.engine) as session:
+            job = Broadcast(
+                kind=kind,
+                payload=json.dumps(payload),
+                chat_id=chat_id,
+                total=total,
+                owner=self.owner,
+                lease_until=time.time() + self.lease_seconds
+            )
+            session.add(job)
+            session.commit()
+            session.refresh(job)
+            return job
+
+    def _get_job(self, job_id):
+        with Session(self.engine) as session:
+            return session.get(Broadcast, job_id)
+
+    def _claim_expired_jobs(self):
+        """Take over every running job whose lease expired, return the ones we got."""
+        now = time.time()
+        claimed = []
+        # The claimed rows are used after the session, a commit must not expire them
+        with Session(self.engine, expire_on_commit=False) as session:
+            job_ids = session.exec(
+                select(Broadcast.id).where(
+                    Broadcast.status == BROADCAST_RUNNING,
+                    Broadcast.lease_until < now
+                )
+            ).all()
+            for job_id in job_ids:
+                # Only one process can match the expired lease, the others update nothing
+                result = session.exec(
+                    update(Broadcast)
+                    .where(
+                        Broadcast.id == job_id,
+                        Broadcast.status == BROADCAST_RUNNING,
+                        Broadcast.lease_until < now
+                    )
+                    .values(owner=self.owner, lease_until=now + self.lease_seconds)
+                )
+                session.commit()
+                if result.rowcount == 1:
+                    claimed.append(session.get(Broadcast, job_id))
+        return claimed
+
+    def _checkpoint(self, job_id, cursor, sent, failed, status=BROADCAST_RUNNING):
+        with Session(self.engine) as session:
+            result = session.exec(
+                update(Broadcast)
+                .where(Broadcast.id == job_id, Broadcast.owner == self.owner)
+                .values(
+                    cursor=cursor,
+                    sent=sent,
+                    failed=failed,
+                    status=status,
+                    lease_until=time.time() + self.lease_seconds,
+                    update_date=datetime.now(timezone.utc)
+                )
+            )
+            session.commit()
+        if result.rowcount != 1:
+            raise LeaseLost(f"Broadcast #{job_id} is now delivered by another process")
+
+    # -------------------------------------------------------------------------
+    # Control
+    # -------------------------------------------------------------------------
+
+    async def start(self, kind, payload, chat_id=None):
+        job = await run_db(self._create_job, kind, payload, chat_id)
+        self._spawn(job)
+        return job.id
+
+    async def resume_pending(self):
+        jobs = await run_db(self._claim_expired_jobs)
+        for job in jobs:
+            if job.id not in self._tasks:
+                print(f"Resuming broadcast #{job.id} after user_id {job.cursor}")
+                self._spawn(job)
+        return [job.id for job in jobs]
+
+    async def watch(self):
+        """Resume interrupted broadcasts now and whenever another process's lease expires."""
+        while True:
+            try:
+                await self.resume_pending()
+            except Exception as e:
+                print(f"Resuming broadcasts failed: {e}")
+            await asyncio.sleep(self.lease_seconds / 2)
+
+    def _spawn(self, job):
+        self.progress[job.id] = BroadcastProgress(job)
+        self._tasks[job.id] = asyncio.create_task(self._run(job))
+
+    def status(self):
+        return [progress.summary() for progress in self.progress.values()]
+
+    # -------------------------------------------------------------------------
+    # Delivery
+    # -------------------------------------------------------------------------
+
+    async def _deliver(self, kind, payload, user_id):
+        if kind == "copy":
+            await self.bot.copy_message(user_id, payload["from_chat_id"], payload["message_id"])
+        elif kind == "text":
+            await self.bot.send_message(
+                chat_id=user_id,
+                text=payload["text"],
+                parse_mode=payload.get("parse_mode")
+            )
+        elif kind == "photo":
+            await self.media.send_photo(
+                chat_id=user_id,
+                path=payload["path"],
+                caption=payload.get("caption"),
+                parse_mode=payload.get("parse_mode")
+            )
+        else:
+            raise ValueError(f"Unknown broadcast kind: {kind}")
+
+    async def _send(self, job_id, kind, payload, user_id):
+        for _ in range(self.max_retries):
+            try:
+                await self._deliver(kind, payload, user_id)
+                return True
+            except ApiTelegramException as e:
+                # The scheduler has paused every lane for the retry_after, the next try waits for it
+                if get_retry_after(e) is None:
+                    print(f"Broadcast #{job_id} failed for {user_id}: {e}")
+                    return False
+            except Exception as e:
+                print(f"Broadcast #{job_id} failed for {user_id}: {e}")
+                return False
+        print(f"Broadcast #{job_id} gave up on {user_id} after {self.max_retries} retries")
+        return False
+
+    async def _run(self, job):
+        # API calls of this task are reported under "broadcast", not the command that started it,
+        # and queue behind interactive replies
+        current_handler.set("broadcast")
+        current_chat.set(None)
+        outbound_lane.set(LANE_BULK)
+        progress = self.progress[job.id]
+        payload = json.loads(job.payload)
+        cursor = job.cursor
+        try:
+            while True:
+                user_ids = await run_db(
+                    self.storage.get_user_ids_after,
+                    cursor=cursor,
+                    limit=self.batch_size
+                )
+                if not user_ids:
+                    break
+                queue = deque(user_ids)
+
+                async def worker():
+                    while queue:
+                        user_id = queue.popleft()
+                        if await self._send(job.id, job.kind, payload, user_id):
+                            progress.sent += 1
+                        else:
+                            progress.failed += 1
+
+                await asyncio.gather(*(worker() for _ in range(min(self.workers, len(user_ids)))))
+                cursor = user_ids[-1]
+                await run_db(self._checkpoint, job.id, cursor, progress.sent, progress.failed)
+
+            await run_db(self._checkpoint, job.id, cursor, progress.sent, progress.failed, BROADCAST_DONE)
+            if job.chat_id:
+                await self.bot.send_message(
+                    chat_id=job.chat_id,
+                    text=f"Broadcast #{job.id} finished: sent to {progress.sent} users, {progress.failed} failed."
+                )
+        except LeaseLost as e:
+            print(e)
+        except Exception as e:
+            # Status stays "running", the job is picked up again once the lease expires
+            print(f"Broadcast #{job.id} stopped: {e}")
+        finally:
+            self._tasks.pop(job.id, None)
+            self.progress.pop(job.id, None)
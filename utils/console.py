@@ -0,0 +1,231 @@
+import time
+import asyncio
+import secrets
+import functools
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import select
+from sqlalchemy.exc import OperationalError
+from utils.assets import send_or_edit
+from utils.export import EXPORT_TABLES
+from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+
+
+CONSOLE_TABLES = EXPORT_TABLES
+CONSOLE_DEFAULT_TABLE = "user"
+# Longer values are cut so a page always fits in one message
+CONSOLE_VALUE_WIDTH = 64
+MESSAGE_LIMIT = 4096
+
+# Admin queries get their own thread, a slow one never takes a DB worker from users
+console_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="console")
+
+
+async def run_console(func, *args, **kwargs):
+    """Like `run_db`, but on the console executor, for admin-only scans."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(console_executor, functools.partial(func, *args, **kwargs))
+
+
+class QueryTimeout(Exception):
+    pass
+
+
+
+class ConsoleQuery:
+    """A whitelisted query: columns of one table and `column = value` filters.
+
+    Tables come from CONSOLE_TABLES and columns from the table definition,
+    filter values are always bound as parameters. Parsed from the /sql
+    arguments:
+
+        "given_name"                   -> user.given_name
+        "kua user_id kua_number gender=female"
+        "user city=Mashhad"            -> every user column, one filter
+    """
+
+    __slots__ = ("table", "columns", "filters")
+
+    def __init__(self, table, columns, filters):
+        self.table = table
+        self.columns = columns
+        self.filters = filters
+
+    @classmethod
+    def parse(cls, text):
+        tokens = text.split()
+        table_name = CONSOLE_DEFAULT_TABLE
+        if tokens and tokens[0].lower() in CONSOLE_TABLES:
+            table_name = tokens.pop(0).lower()
+        table = CONSOLE_TABLES[table_name]
+        known = table.__table__.c
+
+        columns, filters = [], []
+        for token in tokens:
+            name, is_filter, value = token.partition("=")
+            if name not in known:
+                raise ValueError(f"Unknown column {name!r}, {table_name} has: {', '.join(known.keys())}")
+            if is_filter:
+                filters.append((name, cast_filter_value(known[name], value)))
+            else:
+                columns.append(name)
+        return cls(table, columns or known.keys(), filters)
+
+    def describe(self):
+        filters = " ".join(f"{name}={value}" for name, value in self.filters)
+        return f"{self.table.__tablename__}({', '.join(self.columns)}) {filters}".strip()
+
+
+def cast_filter_value(column, value):
+    # Postgres will not compare an integer column with a string
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        return value
+    if python_type in (int, float):
+        try:
+            return python_type(value)
+        except ValueError:
+            raise ValueError(f"{column.name} needs a number, got {value!r}") from None
+    return value
+
+
+
+@contextmanager
+def statement_timeout(connection, timeout):
+    """Abort statements on `connection` that run longer than `timeout` seconds.
+
+    SQLite calls the progress handler every 1000 VM instructions and stops
+    the statement once it returns true. Postgres has statement_timeout; the
+    transaction is also made read-only there, since the console may share
+    the writer's pool.
+    """
+    dialect = connection.dialect.name
+    if dialect == "sqlite":
+        deadline = time.monotonic() + timeout
+        dbapi_connection = connection.connection.driver_connection
+        dbapi_connection.set_progress_handler(lambda: time.monotonic() > deadline, 1000)
+        try:
+            yield
+        finally:
+            dbapi_connection.set_progress_handler(None, 0)
+    elif dialect == "postgresql":
+        connection.exec_driver_sql("SET TRANSACTION READ ONLY")
+        connection.exec_driver_sql(f"SET LOCAL statement_timeout = {int(timeout * 1000)}")
+        yield
+    else:
+        yield
+
+
+def fetch_page(engine, query, cursor, limit, timeout):
+    """One page of `query` in user_id order after `cursor`.
+
+    Returns (rows, next_cursor), next_cursor is None on the last page.
+    Pagination is keyset based, so a deep page costs the same as the first.
+    """
+    table = query.table
+    key = table.__table__.c.user_id
+    statement = (
+        select(key, *(table.__table__.c[name] for name in query.columns))
+        .where(*(table.__table__.c[name] == value for name, value in query.filters))
+        .order_by(key)
+        .limit(limit + 1)
+    )
+    if cursor is not None:
+        statement = statement.where(key > cursor)
+    try:
+        with engine.connect() as connection:
+            with statement_timeout(connection, timeout):
+                rows = connection.execute(statement).all()
+    except OperationalError as e:
+        message = str(e.orig).lower()
+        if "interrupted" in message or "statement timeout" in message:
+            raise QueryTimeout(f"Query took longer than {timeout}s") from None
+        raise
+    next_cursor = rows[limit - 1][0] if len(rows) > limit else None
+    return [row[1:] for row in rows[:limit]], next_cursor
+
+
+def format_page(query, rows, page):
+    lines = [f"{query.describe()}, page {page}", " | ".join(query.columns)]
+    for row in rows:
+        lines.append(" | ".join(
+            "-" if value is None else str(value)[:CONSOLE_VALUE_WIDTH] for value in row
+        ))
+    if not rows:
+        lines.append("No rows.")
+    text = "\n".join(lines)
+    return text if len(text) <= MESSAGE_LIMIT else text[:MESSAGE_LIMIT - 1] + "…"
+
+
+
+class QueryConsole:
+    """Read-only, paginated admin queries sent as one message per page.
+
+    Each query is kept under a short token so the "next page" button only
+    has to carry the token, the page number and the last user_id
+    ("sql_next_<token>.<page>.<cursor>", well under Telegram's 64 bytes).
+    The oldest queries are forgotten past `max_queries`.
+    """
+
+    def __init__(self, bot, storage, page_size=20, timeout=2.0, max_queries=256):
+        self.bot = bot
+        self.storage = storage
+        self.page_size = page_size
+        self.timeout = timeout
+        self.max_queries = max_queries
+        self._queries = OrderedDict()
+
+    async def _fetch(self, query, cursor):
+        return await run_console(
+            self.storage.query_page,
+            query=query,
+            cursor=cursor,
+            limit=self.page_size,
+            timeout=self.timeout
+        )
+
+    def _remember(self, query):
+        token = secrets.token_hex(4)
+        self._queries[token] = query
+        while len(self._queries) > self.max_queries:
+            self._queries.popitem(last=False)
+        return token
+
+    async def _send_page(self, chat_id, token, query, page, cursor, message_id=None):
+        try:
+            rows, next_cursor = await self._fetch(query, cursor)
+        except QueryTimeout as e:
+            await self.bot.send_message(chat_id=chat_id, text=str(e))
+            return
+        markup = None
+        if next_cursor is not None:
+            markup = InlineKeyboardMarkup()
+            markup.add(InlineKeyboardButton(
+                "Next page ▶️", callback_data=f"sql_next_{token}.{page + 1}.{next_cursor}"
+            ))
+        await send_or_edit(
+            self.bot,
+            chat_id=chat_id,
+            text=format_page(query, rows, page),
+            reply_markup=markup,
+            message_id=message_id
+        )
+
+    async def start(self, chat_id, text):
+        try:
+            query = ConsoleQuery.parse(text)
+        except ValueError as e:
+            await self.bot.send_message(chat_id=chat_id, text=str(e))
+            return
+        await self._send_page(chat_id, self._remember(query), query, page=1, cursor=None)
+
+    async def next_page(self, chat_id, message_id, value):
+        token, page, cursor = str(value).split(".", 2)
+        query = self._queries.get(token)
+        if query is None:
+            await self.bot.send_message(chat_id=chat_id, text="This query has expired, run /sql again.")
+            return
+        await self._send_page(chat_id, token, query, int(page), int(cursor), message_id=message_id)
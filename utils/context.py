@@ -0,0 +1,61 @@
+from contextvars import ContextVar
+from sqlalchemy import literal
+from sqlmodel import Session, select
+from models import User, Kua, Zodiac, Mashhad
+from utils.database import run_db
+
+
+
+class UserContext:
+    """Everything stored about one user, loaded once per update."""
+
+    __slots__ = ("user_id", "user", "kua", "zodiac", "mashhad")
+
+    def __init__(self, user_id, user=None, kua=None, zodiac=None, mashhad=None):
+        self.user_id = user_id
+        self.user = user
+        self.kua = kua
+        self.zodiac = zodiac
+        self.mashhad = mashhad
+
+    def row(self, table):
+        return getattr(self, table.__tablename__)
+
+    def count_visit(self, table):
+        row = self.row(table)
+        return (row.count_visit or 0) if row else 0
+
+    def can_calculate(self, table, max_calculation):
+        return self.count_visit(table) < max_calculation
+
+    def is_registered(self, table):
+        return self.row(table) is not None
+
+
+def load_user_context(engine, user_id):
+    # One round-trip: a single-row "user_id" relation outer-joined to every table
+    uid = select(literal(user_id).label("user_id")).subquery()
+    statement = (
+        select(User, Kua, Zodiac, Mashhad)
+        .select_from(uid)
+        .outerjoin(User, User.user_id == uid.c.user_id)
+        .outerjoin(Kua, Kua.user_id == uid.c.user_id)
+        .outerjoin(Zodiac, Zodiac.user_id == uid.c.user_id)
+        .outerjoin(Mashhad, Mashhad.user_id == uid.c.user_id)
+    )
+    with Session(engine) as session:
+        user, kua, zodiac, mashhad = session.exec(statement).one()
+    return UserContext(user_id, user=user, kua=kua, zodiac=zodiac, mashhad=mashhad)
+
+
+# Telebot runs every update in its own task, so this is scoped to one update
+_current_context = ContextVar("user_context", default=None)
+
+
+async def get_user_context(storage, user_id):
+    """Return the context of `user_id` for the current update, loading it on first use."""
+    context = _current_context.get()
+    if context is None or context.user_id != user_id:
+        context = await run_db(storage.load_user_context, user_id)
+        _current_context.set(context)
+    return context
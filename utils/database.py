@@ -0,0 +1,122 @@
+import os
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import create_engine, event
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+
+
+
+# SQLite serialises writers anyway, a few threads are enough to keep reads flowing
+DB_WORKERS = int(os.getenv("DB_WORKERS", 4))
+
+db_executor = ThreadPoolExecutor(
+    max_workers=DB_WORKERS,
+    thread_name_prefix="db"
+)
+
+
+async def run_db(func, *args, **kwargs):
+    """Run a blocking database call on the DB executor and await its result.
+
+    Handlers must never open a `Session` on the event loop: one slow commit
+    would stall every other update. Wrap the synchronous helper instead:
+
+        users = await run_db(get_all_rows, engine=read_engine, table=User)
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(db_executor, functools.partial(func, *args, **kwargs))
+
+
+
+def dialect_insert(engine, table):
+    # Both dialects support ON CONFLICT ... DO UPDATE ... RETURNING
+    if engine.dialect.name == "postgresql":
+        return postgresql_insert(table)
+    return sqlite_insert(table)
+
+
+
+# ------------------------------------------------------------------------------
+# SQLite Storage Profile
+# ------------------------------------------------------------------------------
+
+# Applied to every new connection through the engine "connect" event
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 5000,
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -64 * 1024,
+    "temp_store": "MEMORY",
+}
+
+# journal_mode is a property of the file and can not be changed read-only
+SQLITE_READ_PRAGMAS = {
+    **{name: value for name, value in SQLITE_PRAGMAS.items() if name != "journal_mode"},
+    "query_only": "ON",
+}
+
+
+def apply_sqlite_pragmas(engine, pragmas):
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+    return engine
+
+
+def create_sqlite_engines(path, read_pool_size=DB_WORKERS, pool_timeout=30):
+    """Return (writer, reader) engines for the SQLite file at `path`.
+
+    SQLite allows one writer at a time, so the writer pool holds a single
+    connection and writes queue in the pool instead of failing with
+    "database is locked". With WAL, readers never block the writer and get
+    their own read-only pool sized for the DB executor.
+    """
+    writer = create_engine(
+        f"sqlite:///{path}",
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=pool_timeout
+    )
+    apply_sqlite_pragmas(writer, SQLITE_PRAGMAS)
+    reader = create_sqlite_reader(path, pool_size=read_pool_size, pool_timeout=pool_timeout)
+    return writer, reader
+
+
+def create_sqlite_reader(path, pool_size=1, pool_timeout=30):
+    """A read-only engine on the SQLite file at `path`, opened with mode=ro."""
+    reader = create_engine(
+        f"sqlite:///file:{path}?mode=ro&uri=true",
+        pool_size=pool_size,
+        max_overflow=0,
+        pool_timeout=pool_timeout
+    )
+    return apply_sqlite_pragmas(reader, SQLITE_READ_PRAGMAS)
+
+
+def get_sqlite_settings(engine):
+    with engine.connect() as connection:
+        return {
+            name: connection.exec_driver_sql(f"PRAGMA {name}").scalar()
+            for name in SQLITE_READ_PRAGMAS
+        } | {"journal_mode": connection.exec_driver_sql("PRAGMA journal_mode").scalar()}
+
+
+def report_storage_settings(writer, reader=None):
+    """Print the settings the connections really run with and warn about surprises."""
+    for label, engine in (("writer", writer), ("reader", reader)):
+        if engine is None:
+            continue
+        settings = get_sqlite_settings(engine)
+        pool = engine.pool
+        print(
+            f"SQLite {label}: pool={pool.__class__.__name__}(size={pool.size()}), "
+            + ", ".join(f"{name}={value}" for name, value in settings.items())
+        )
+        if str(settings["journal_mode"]).lower() != "wal":
+            print(f"Warning: SQLite {label} is not in WAL mode ({settings['journal_mode']})")
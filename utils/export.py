@@ -0,0 +1,79 @@
+import os
+import csv
+import gzip
+import asyncio
+import tempfile
+import functools
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import select
+from models import User, Kua, Zodiac, Mashhad
+
+
+
+EXPORT_TABLES = {table.__tablename__: table for table in (User, Kua, Zodiac, Mashhad)}
+EXPORT_CHUNK_SIZE = 1000
+# Bots can upload documents up to 50 MB
+EXPORT_MAX_BYTES = 50 * 1024 * 1024
+
+# Exports get their own thread, a whole-table dump never takes a DB worker from users
+export_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="export")
+
+
+def iter_table_rows(engine, table, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield the rows of `table` as tuples, fetched `chunk_size` at a time.
+
+    `yield_per` makes the driver stream the result (a server-side cursor on
+    Postgres), so only one chunk is held in memory at once.
+    """
+    with engine.connect() as connection:
+        result = connection.execution_options(yield_per=chunk_size).execute(select(table.__table__))
+        for partition in result.partitions():
+            yield from partition
+
+
+def write_csv_gz(path, columns, rows):
+    """Write a header and `rows` to a gzip-compressed CSV, return the row count.
+
+    The BOM lets Excel detect UTF-8 and show the Persian text correctly.
+    """
+    count = 0
+    with gzip.open(path, "wt", encoding="utf-8-sig", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(columns)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    return count
+
+
+async def send_table_export(bot, storage, chat_id, table_name):
+    """Export one table to a temporary .csv.gz and send it to `chat_id` as a document."""
+    table = EXPORT_TABLES[table_name]
+    fd, path = tempfile.mkstemp(prefix=f"{table_name}-", suffix=".csv.gz")
+    os.close(fd)
+    try:
+        loop = asyncio.get_running_loop()
+        count = await loop.run_in_executor(
+            export_executor,
+            functools.partial(storage.export_table, table=table, path=path)
+        )
+        size = os.path.getsize(path)
+        if size > EXPORT_MAX_BYTES:
+            await bot.send_message(
+                chat_id=chat_id,
+                text=f"Export of {table_name} is {size / 1024 / 1024:.1f} MB, over Telegram's 50 MB limit."
+            )
+            return
+        with open(path, "rb") as file:
+            await bot.send_document(
+                chat_id,
+                file,
+                visible_file_name=f"{table_name}-{datetime.now():%Y%m%d-%H%M%S}.csv.gz",
+                caption=f"{table_name}: {count} rows"
+            )
+    except Exception as e:
+        print(f"Export of {table_name} failed: {e}")
+        await bot.send_message(chat_id=chat_id, text=f"Export of {table_name} failed: {e}")
+    finally:
+        os.remove(path)
@@ -35,9 +35,21 @@
 #  (1393, 1, 11)
 #  >>> jalali.Gregorian(2014, 3, 31).persian_year
 #  1393
+#
+#  Table lookups (years 1320-1419, arithmetic outside that range):
+#
+#  >>> jalali.to_gregorian(1393, 1, 11)
+#  (2014, 3, 31)
+#  >>> jalali.to_persian(2014, 3, 31)
+#  (1393, 1, 11)
+#  >>> jalali.is_valid_persian(1402, 12, 30)
+#  False
+#  >>> jalali.parse_persian_date('۱۳۷۰-۰۵-۰۳')
+#  (1370, 5, 3)
 
 import re
 import datetime
+from array import array
 
 
 class Gregorian:
@@ -51,7 +63,7 @@ class Gregorian:
                 if m:
                     [year, month, day] = [int(m.group(1)), int(m.group(2)), int(m.group(3))]
                 else:
-                    raise Exception("Invalid Input String")
+                    raise ValueError("Invalid Input String")
             elif type(date) is datetime.date:
                 [year, month, day] = [date.year, date.month, date.day]
             elif type(date) is tuple:
@@ -60,19 +72,19 @@ class Gregorian:
                 month = int(month)
                 day = int(day)
             else:
-                raise Exception("Invalid Input Type")
+                raise ValueError("Invalid Input Type")
         elif len(date) == 3:
             year = int(date[0])
             month = int(date[1])
             day = int(date[2])
         else:
-            raise Exception("Invalid Input")
+            raise ValueError("Invalid Input")
 
         # Check the validity of input date
         try:
             datetime.datetime(year, month, day)
-        except:
-            raise Exception("Invalid Date")
+        except (ValueError, OverflowError):
+            raise ValueError("Invalid Date")
 
         self.gregorian_year = year
         self.gregorian_month = month
@@ -129,58 +141,29 @@ class Persian:
                 if m:
                     [year, month, day] = [int(m.group(1)), int(m.group(2)), int(m.group(3))]
                 else:
-                    raise Exception("Invalid Input String")
+                    raise ValueError("Invalid Input String")
             elif type(date) is tuple:
                 year, month, day = date
                 year = int(year)
                 month = int(month)
                 day = int(day)
             else:
-                raise Exception("Invalid Input Type")
+                raise ValueError("Invalid Input Type")
         elif len(date) == 3:
             year = int(date[0])
             month = int(date[1])
             day = int(date[2])
         else:
-            raise Exception("Invalid Input")
+            raise ValueError("Invalid Input")
 
-        # Check validity of date. TODO better check (leap years)
-        if year < 1 or month < 1 or month > 12 or day < 1 or day > 31 or (month > 6 and day == 31):
-            raise Exception("Incorrect Date")
+        # Check validity of date, Esfand 30 only exists in leap years
+        if not is_valid_persian(year, month, day):
+            raise ValueError("Incorrect Date")
 
         self.persian_year = year
         self.persian_month = month
         self.persian_day = day
-
-        # Convert date
-        d_4 = (year + 1) % 4
-        if month < 7:
-            doy_j = ((month - 1) * 31) + day
-        else:
-            doy_j = ((month - 7) * 30) + day + 186
-        d_33 = int(((year - 55) % 132) * .0305)
-        a = 287 if (d_33 != 3 and d_4 <= d_33) else 286
-        if (d_33 == 1 or d_33 == 2) and (d_33 == d_4 or d_4 == 1):
-            b = 78
-        else:
-            b = 80 if (d_33 == 3 and d_4 == 0) else 79
-        if int((year - 19) / 63) == 20:
-            a -= 1
-            b += 1
-        if doy_j <= a:
-            gy = year + 621
-            gd = doy_j + b
-        else:
-            gy = year + 622
-            gd = doy_j - a
-        for gm, v in enumerate([0, 31, 29 if (gy % 4 == 0) else 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]):
-            if gd <= v:
-                break
-            gd -= v
-
-        self.gregorian_year = gy
-        self.gregorian_month = gm
-        self.gregorian_day = gd
+        self.gregorian_year, self.gregorian_month, self.gregorian_day = _persian_to_gregorian(year, month, day)
 
     def gregorian_tuple(self):
         return self.gregorian_year, self.gregorian_month, self.gregorian_day
@@ -189,4 +172,152 @@ class Persian:
         return date_format.format(self.gregorian_year, self.gregorian_month, self.gregorian_day)
 
     def gregorian_datetime(self):
-        return datetime.date(self.gregorian_year, self.gregorian_month, self.gregorian_day)
\ No newline at end of file
+        return datetime.date(self.gregorian_year, self.gregorian_month, self.gregorian_day)
+
+
+def _persian_to_gregorian(year, month, day):
+    # Arithmetic conversion, the date must already be valid
+    d_4 = (year + 1) % 4
+    if month < 7:
+        doy_j = ((month - 1) * 31) + day
+    else:
+        doy_j = ((month - 7) * 30) + day + 186
+    d_33 = int(((year - 55) % 132) * .0305)
+    a = 287 if (d_33 != 3 and d_4 <= d_33) else 286
+    if (d_33 == 1 or d_33 == 2) and (d_33 == d_4 or d_4 == 1):
+        b = 78
+    else:
+        b = 80 if (d_33 == 3 and d_4 == 0) else 79
+    if int((year - 19) / 63) == 20:
+        a -= 1
+        b += 1
+    if doy_j <= a:
+        gy = year + 621
+        gd = doy_j + b
+    else:
+        gy = year + 622
+        gd = doy_j - a
+    for gm, v in enumerate([0, 31, 29 if (gy % 4 == 0) else 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]):
+        if gd <= v:
+            break
+        gd -= v
+
+    return gy, gm, gd
+
+
+
+# ------------------------------------------------------------------------------
+# Lookup table for the years the date picker offers
+# ------------------------------------------------------------------------------
+#
+# YEAR_STARTS[i] is the Gregorian ordinal of 1 Farvardin of TABLE_FIRST_YEAR + i
+# (one extra entry closes the last year), so a Jalali date is one addition away
+# from its ordinal. DAYS packs every day of the range as (year offset << 9) |
+# day of year, indexed by ordinal - YEAR_STARTS[0], for the other direction,
+# and GREGORIAN the matching (year << 9) | (month << 5) | day so a table hit
+# never builds a datetime.date.
+# Years outside the range go through the arithmetic above.
+
+TABLE_FIRST_YEAR = 1320
+TABLE_LAST_YEAR = 1419
+
+# Day of year (0-based) of the first day of each month, index 0 unused
+MONTH_STARTS = (0, 0, 31, 62, 93, 124, 155, 186, 216, 246, 276, 306, 336)
+
+# Month of each day of year, to unpack DAYS without a search
+_DAY_MONTHS = bytes(month for month in range(1, 13) for _ in range(31 if month < 7 else 30))
+
+
+def _arithmetic_ordinal(year, month, day):
+    return datetime.date(*_persian_to_gregorian(year, month, day)).toordinal()
+
+
+YEAR_STARTS = array("l", (
+    _arithmetic_ordinal(year, 1, 1) for year in range(TABLE_FIRST_YEAR, TABLE_LAST_YEAR + 2)
+))
+
+DAYS = array("H")
+for _offset in range(len(YEAR_STARTS) - 1):
+    DAYS.extend((_offset << 9) | day for day in range(YEAR_STARTS[_offset + 1] - YEAR_STARTS[_offset]))
+del _offset
+
+GREGORIAN = array("I", (
+    (date.year << 9) | (date.month << 5) | date.day
+    for date in map(datetime.date.fromordinal, range(YEAR_STARTS[0], YEAR_STARTS[-1]))
+))
+
+
+def is_leap_persian(year):
+    offset = year - TABLE_FIRST_YEAR
+    if 0 <= offset < len(YEAR_STARTS) - 1:
+        return YEAR_STARTS[offset + 1] - YEAR_STARTS[offset] == 366
+    return _arithmetic_ordinal(year + 1, 1, 1) - _arithmetic_ordinal(year, 1, 1) == 366
+
+
+def persian_month_length(year, month):
+    if month < 7:
+        return 31
+    if month < 12:
+        return 30
+    return 30 if is_leap_persian(year) else 29
+
+
+def is_valid_persian(year, month, day):
+    return year >= 1 and 1 <= month <= 12 and 1 <= day <= persian_month_length(year, month)
+
+
+def to_gregorian(year, month, day):
+    """(year, month, day) Jalali -> Gregorian tuple. Raises ValueError on invalid dates."""
+    offset = year - TABLE_FIRST_YEAR
+    if 0 <= offset < len(YEAR_STARTS) - 1 and 1 <= month <= 12 and 1 <= day <= (31 if month < 7 else 30):
+        # Esfand 30 of a common year lands on the next year's start
+        ordinal = YEAR_STARTS[offset] + MONTH_STARTS[month] + day - 1
+        if ordinal < YEAR_STARTS[offset + 1]:
+            packed = GREGORIAN[ordinal - YEAR_STARTS[0]]
+            return packed >> 9, (packed >> 5) & 0xF, packed & 0x1F
+    if not is_valid_persian(year, month, day):
+        raise ValueError(f"Incorrect Date: {year}-{month}-{day}")
+    return _persian_to_gregorian(year, month, day)
+
+
+def to_persian(year, month, day):
+    """(year, month, day) Gregorian -> Jalali tuple. Raises ValueError on invalid dates."""
+    try:
+        index = datetime.date(year, month, day).toordinal() - YEAR_STARTS[0]
+    except (ValueError, OverflowError):
+        raise ValueError(f"Invalid Date: {year}-{month}-{day}")
+    if 0 <= index < len(DAYS):
+        packed = DAYS[index]
+        day_of_year = packed & 0x1FF
+        month = _DAY_MONTHS[day_of_year]
+        return TABLE_FIRST_YEAR + (packed >> 9), month, day_of_year - MONTH_STARTS[month] + 1
+    return Gregorian(year, month, day).persian_tuple()
+
+
+
+# ------------------------------------------------------------------------------
+# Typed dates
+# ------------------------------------------------------------------------------
+
+# Persian and Arabic-Indic digits to ASCII
+DIGITS = str.maketrans("۰۱۲۳۴۵۶۷۸۹٠١٢٣٤٥٦٧٨٩", "01234567890123456789")
+
+DATE_PATTERN = re.compile(r'^(\d{4})\s*[/\-.,،٫\s]\s*(\d{1,2})\s*[/\-.,،٫\s]\s*(\d{1,2})$')
+
+
+def normalize_digits(text):
+    return text.translate(DIGITS)
+
+
+def parse_persian_date(text):
+    """'1370/5/3', '۱۳۷۰-۰۵-۰۳', '1370 5 3' ... -> (1370, 5, 3).
+
+    Raises ValueError when the text is not a date or the date does not exist.
+    """
+    m = DATE_PATTERN.match(normalize_digits(text).strip())
+    if not m:
+        raise ValueError("Invalid Input String")
+    year, month, day = int(m.group(1)), int(m.group(2)), int(m.group(3))
+    if not is_valid_persian(year, month, day):
+        raise ValueError("Incorrect Date")
+    return year, month, day
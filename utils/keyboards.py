@@ -0,0 +1,30 @@
+class KeyboardRegistry:
+    """Inline keyboards built once and kept as their serialized JSON.
+
+    The bot only ever shows a handful of keyboards (the dashboard, one per
+    wizard step and prefix, one per decade), so each is built on first use
+    and the JSON string is reused for every later send. Telebot passes a
+    str `reply_markup` through unchanged:
+
+        markup = keyboards.get(("dashboard",), build_dashboard)
+        await bot.send_message(chat_id=chat_id, text=text, reply_markup=markup)
+    """
+
+    def __init__(self):
+        self._markups = {}
+
+    def __len__(self):
+        return len(self._markups)
+
+    def get(self, key, build, *args, **kwargs):
+        markup = self._markups.get(key)
+        if markup is None:
+            markup = self._markups[key] = build(*args, **kwargs).to_json()
+        return markup
+
+    def clear(self):
+        self._markups.clear()
+
+
+
+keyboards = KeyboardRegistry()
@@ -0,0 +1,64 @@
+# Chinese New Year boundaries for the Zodiac flow
+#
+# The lunar year only changes on Chinese New Year, so the Gregorian date of
+# each New Year is all it takes to find the lunar year of a birth date: one
+# index by Gregorian year and one integer comparison, instead of walking
+# lunardate's month tables.
+#
+#  >>> lunar.chinese_year(datetime.date(1990, 1, 20))
+#  1989
+#  >>> lunar.chinese_year((1990, 1, 27))
+#  1990
+
+import datetime
+from array import array
+
+
+
+FIRST_YEAR = 1900
+LAST_YEAR = 2100
+
+# New Year of each Gregorian year as month * 100 + day, taken from lunardate
+# (1900-2099); 2100 (Feb 9) is past its range and comes from published tables.
+NEW_YEARS = array("H", (
+    131, 219, 208, 129, 216, 204, 125, 213, 202, 122,  # 1900
+    210, 130, 218, 206, 126, 214, 203, 123, 211, 201,  # 1910
+    220, 208, 128, 216, 205, 124, 213, 202, 123, 210,  # 1920
+    130, 217, 206, 126, 214, 204, 124, 211, 131, 219,  # 1930
+    208, 127, 215, 205, 125, 213, 202, 122, 210, 129,  # 1940
+    217, 206, 127, 214, 203, 124, 212, 131, 218, 208,  # 1950
+    128, 215, 205, 125, 213, 202, 121, 209, 130, 217,  # 1960
+    206, 127, 215, 203, 123, 211, 131, 218, 207, 128,  # 1970
+    216, 205, 125, 213, 202, 220, 209, 129, 217, 206,  # 1980
+    127, 215, 204, 123, 210, 131, 219, 207, 128, 216,  # 1990
+    205, 124, 212, 201, 122, 209, 129, 218, 207, 126,  # 2000
+    214, 203, 123, 210, 131, 219, 208, 128, 216, 205,  # 2010
+    125, 212, 201, 122, 210, 129, 217, 206, 126, 213,  # 2020
+    203, 123, 211, 131, 219, 208, 128, 215, 204, 124,  # 2030
+    212, 201, 122, 210, 130, 217, 206, 126, 214, 202,  # 2040
+    123, 211, 201, 219, 208, 128, 215, 204, 124, 212,  # 2050
+    202, 121, 209, 129, 217, 205, 126, 214, 203, 123,  # 2060
+    211, 131, 219, 207, 127, 215, 205, 124, 212, 202,  # 2070
+    122, 209, 129, 217, 206, 126, 214, 203, 124, 210,  # 2080
+    130, 218, 207, 127, 215, 205, 125, 212, 201, 121,  # 2090
+    209,                                               # 2100
+))
+
+
+def chinese_year(date):
+    """Lunar year of a Gregorian `datetime.date` or (year, month, day) tuple.
+
+    Raises ValueError for dates before the 1900 New Year or after 2100.
+    """
+    if isinstance(date, datetime.date):
+        year, month, day = date.year, date.month, date.day
+    else:
+        year, month, day = date
+    offset = year - FIRST_YEAR
+    if not 0 <= offset < len(NEW_YEARS):
+        raise ValueError(f"Year out of range: {year}")
+    if month * 100 + day >= NEW_YEARS[offset]:
+        return year
+    if offset == 0:
+        raise ValueError(f"Date before the {FIRST_YEAR} New Year: {year}-{month}-{day}")
+    return year - 1
@@ -0,0 +1,140 @@
+import os
+import asyncio
+import hashlib
+from sqlmodel import Session, select, delete
+from models import Media
+from utils.database import run_db
+from telebot.asyncio_helper import ApiTelegramException
+
+
+
+# Telegram answers with one of these when a stored file_id can no longer be used
+STALE_FILE_ID_ERRORS = (
+    "wrong file identifier",
+    "wrong remote file identifier",
+    "file reference",
+    "can't use file of type",
+    "failed to get http url content",
+    "wrong type of the web page content",
+)
+
+# Message attributes that may carry the uploaded file, in order of preference
+MEDIA_ATTRIBUTES = ("photo", "audio", "document", "video", "voice", "animation")
+
+
+def file_content_hash(path, chunk_size=1 << 16):
+    sha = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def extract_file_id(message, kind):
+    for attribute in (kind, *MEDIA_ATTRIBUTES):
+        media = getattr(message, attribute, None)
+        if not media:
+            continue
+        if isinstance(media, list):
+            # Photos come back as a list of sizes, the last one is the original
+            media = media[-1]
+        return media.file_id
+    return None
+
+
+def is_stale_file_id_error(error):
+    if not isinstance(error, ApiTelegramException) or error.error_code != 400:
+        return False
+    description = str(error.description).lower()
+    return any(marker in description for marker in STALE_FILE_ID_ERRORS)
+
+
+
+class MediaRegistry:
+    """Upload every local asset once and send the cached Telegram file_id afterwards.
+
+    File ids are keyed by (path, content hash) and persisted in the `media` table,
+    so they survive restarts. A changed file gets a new hash and is uploaded again,
+    and an id rejected by Telegram is dropped and replaced by a fresh upload.
+    """
+
+    def __init__(self, engine, bot):
+        self.engine = engine
+        self.bot = bot
+        self._hashes = {}
+        self._locks = {}
+        with Session(engine) as session:
+            rows = session.exec(select(Media)).all()
+        self._file_ids = {(row.path, row.content_hash): row.file_id for row in rows if row.file_id}
+
+    def content_hash(self, path):
+        stat = os.stat(path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        cached = self._hashes.get(path)
+        if cached and cached[0] == signature:
+            return cached[1]
+        content_hash = file_content_hash(path)
+        self._hashes[path] = (signature, content_hash)
+        return content_hash
+
+    def _store(self, path, content_hash, kind, file_id):
+        with Session(self.engine) as session:
+            # Older versions of the same asset will never be sent again
+            session.exec(
+                delete(Media).where(Media.path == path, Media.content_hash != content_hash)
+            )
+            session.merge(Media(path=path, content_hash=content_hash, kind=kind, file_id=file_id))
+            session.commit()
+
+    def _forget(self, path, content_hash):
+        with Session(self.engine) as session:
+            session.exec(
+                delete(Media).where(Media.path == path, Media.content_hash == content_hash)
+            )
+            session.commit()
+
+    async def _upload(self, kind, chat_id, path, content_hash, **kwargs):
+        method = getattr(self.bot, f"send_{kind}")
+        with open(path, "rb") as file:
+            message = await method(chat_id, file, **kwargs)
+        file_id = extract_file_id(message, kind)
+        if file_id:
+            self._file_ids[(path, content_hash)] = file_id
+            await run_db(self._store, path, content_hash, kind, file_id)
+        return message
+
+    async def send(self, kind, chat_id, path, **kwargs):
+        path = os.path.normpath(path)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Media file not found: {path}")
+        content_hash = self.content_hash(path)
+        key = (path, content_hash)
+
+        file_id = self._file_ids.get(key)
+        if file_id is None:
+            # Concurrent first sends wait for a single upload instead of racing
+            lock = self._locks.setdefault(key, asyncio.Lock())
+            async with lock:
+                file_id = self._file_ids.get(key)
+                if file_id is None:
+                    return await self._upload(kind, chat_id, path, content_hash, **kwargs)
+
+        method = getattr(self.bot, f"send_{kind}")
+        try:
+            return await method(chat_id, file_id, **kwargs)
+        except ApiTelegramException as e:
+            if not is_stale_file_id_error(e):
+                raise
+            print(f"Stale file_id for {path}: {e.description}")
+            self._file_ids.pop((path, content_hash), None)
+            await run_db(self._forget, path, content_hash)
+            return await self._upload(kind, chat_id, path, content_hash, **kwargs)
+
+    async def send_photo(self, chat_id, path, **kwargs):
+        return await self.send("photo", chat_id, path, **kwargs)
+
+    async def send_audio(self, chat_id, path, **kwargs):
+        return await self.send("audio", chat_id, path, **kwargs)
+
+    async def send_document(self, chat_id, path, **kwargs):
+        return await self.send("document", chat_id, path, **kwargs)
@@ -0,0 +1,119 @@
+import time
+import asyncio
+from collections import OrderedDict
+
+
+
+# What to do with a channel whose membership could not be checked
+FAIL_OPEN = "open"
+FAIL_CLOSED = "closed"
+
+
+class MembershipResult:
+    """Outcome of checking one user against several channels.
+
+    `confirmed` and `missing` hold the channels that answered, `failed` the
+    ones that raised or timed out. Under FAIL_CLOSED a failed channel blocks
+    the user like a missing one, under FAIL_OPEN it is ignored.
+    """
+
+    def __init__(self, confirmed, missing, failed, failure_policy=FAIL_CLOSED):
+        self.confirmed = confirmed
+        self.missing = missing
+        self.failed = failed
+        self.failure_policy = failure_policy
+
+    @property
+    def remaining_channels(self):
+        if self.failure_policy == FAIL_OPEN:
+            return list(self.missing)
+        return self.missing + self.failed
+
+    @property
+    def is_member(self):
+        return not self.remaining_channels
+
+    def __iter__(self):
+        # Keeps `is_member, remaining = await is_user_member(...)` working
+        yield self.is_member
+        yield self.remaining_channels
+
+    def __repr__(self):
+        return (
+            f"MembershipResult(confirmed={self.confirmed}, missing={self.missing}, "
+            f"failed={self.failed}, failure_policy={self.failure_policy!r})"
+        )
+
+
+
+class MembershipCache:
+    """LRU cache of channel membership results keyed by (user_id, channel).
+
+    Members are remembered for `positive_ttl` seconds and non-members for the
+    (usually much shorter) `negative_ttl`, so a user who has just joined is not
+    locked out for long. Concurrent lookups for the same key share one request.
+    """
+
+    def __init__(self, positive_ttl=600, negative_ttl=30, max_size=50000):
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._pending = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, user_id, channel):
+        key = (user_id, channel)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        is_member, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return is_member
+
+    def set(self, user_id, channel, is_member):
+        key = (user_id, channel)
+        ttl = self.positive_ttl if is_member else self.negative_ttl
+        self._entries[key] = (is_member, time.monotonic() + ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, user_id, channels):
+        for channel in channels:
+            self._entries.pop((user_id, channel), None)
+            # A lookup already in flight may answer with the old status, it must not be cached
+            self._pending.pop((user_id, channel), None)
+
+    def clear(self):
+        self._entries.clear()
+
+    async def get_or_fetch(self, user_id, channel, fetch):
+        """Return the cached status or await `fetch()` once for all concurrent callers.
+
+        Errors raised by `fetch` are propagated and never cached.
+        """
+        is_member = self.get(user_id, channel)
+        if is_member is not None:
+            return is_member
+        key = (user_id, channel)
+        pending = self._pending.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+        pending = asyncio.ensure_future(fetch())
+        self._pending[key] = pending
+        try:
+            is_member = await asyncio.shield(pending)
+        finally:
+            current = self._pending.get(key) is pending
+            if current:
+                self._pending.pop(key)
+        # Invalidated while fetching, the answer may predate the change
+        if current:
+            self.set(user_id, channel, is_member)
+        return is_member
@@ -0,0 +1,278 @@
+"""In-process metrics in the Prometheus text format, served by aiohttp.
+
+Every message handler registered on the bot and every callback route is
+wrapped once at startup, after all handlers exist:
+
+    metrics = BotMetrics()
+    metrics.instrument_bot(bot)
+    metrics.instrument_router(router)
+    runner = await serve_metrics(metrics, port=9100)
+
+and scraped with `curl localhost:9100/metrics`.
+"""
+import time
+import functools
+import threading
+import contextvars
+from bisect import bisect_left
+from aiohttp import web
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Name of the handler the current task is running, for attributing API calls
+current_handler = contextvars.ContextVar("current_handler", default="background")
+# Chat of the update the current task is answering, None outside handlers
+current_chat = contextvars.ContextVar("current_chat", default=None)
+
+
+def update_chat_id(update):
+    # Handlers get a Message or a CallbackQuery
+    message = getattr(update, "message", update)
+    chat = getattr(message, "chat", None)
+    if chat is not None:
+        return chat.id
+    user = getattr(update, "from_user", None)
+    return user.id if user is not None else None
+
+
+# Statement kinds counted by instrument_database, anything else is "other"
+SQL_STATEMENT_KINDS = ("select", "insert", "update", "delete")
+SQL_WRITE_KINDS = ("insert", "update", "delete")
+
+
+def statement_kind(statement):
+    words = statement.split(None, 1)
+    kind = words[0].lower() if words else ""
+    return kind if kind in SQL_STATEMENT_KINDS else "other"
+
+
+def escape_label_value(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label_value(value)}"' for name, value in pairs) + "}"
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+
+class Metric:
+    """One metric family, its samples keyed by the tuple of label values."""
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def samples(self):
+        return dict(self._values)
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{format_labels(self.labelnames, labels)} {format_value(value)}")
+        return lines
+
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def get(self, *labels):
+        return self._values.get(labels, 0)
+
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, value, *labels):
+        self._values[labels] = value
+
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        sample = self._values.get(labels)
+        if sample is None:
+            # Per-bucket counts (the last one is +Inf), sum, count
+            sample = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        sample[0][bisect_left(self.buckets, value)] += 1
+        sample[1] += value
+        sample[2] += 1
+
+    def get_count(self, *labels):
+        sample = self._values.get(labels)
+        return sample[2] if sample else 0
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for labels, (counts, total, count) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, float("inf")), counts):
+                cumulative += bucket_count
+                bucket_labels = format_labels(self.labelnames, labels, extra=[("le", format_value(bound))])
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labelnames, labels)} {format_value(total)}")
+            lines.append(f"{self.name}_count{format_labels(self.labelnames, labels)} {count}")
+        return lines
+
+
+
+class MetricsRegistry:
+
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def expose(self):
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.expose())
+        return "\n".join(lines) + "\n"
+
+
+
+class BotMetrics:
+    """Latency, in-flight and error figures per handler, plus a funnel of flow steps.
+
+    Handlers are named after their function, callback routes after their
+    callback data prefix ("kua_decade"). Every routed callback also counts
+    as one step of its flow, so the Kua/Zodiac funnel reads straight off
+    bot_flow_steps_total. `instrument_database` adds every SQL statement
+    the process runs, on any engine, to bot_db_statements_total.
+    """
+
+    def __init__(self, registry=None):
+        self.registry = registry or MetricsRegistry()
+        self.latency = self.registry.histogram(
+            "bot_handler_latency_seconds", "Time spent in each handler.", ["handler"]
+        )
+        self.in_flight = self.registry.gauge(
+            "bot_handler_in_flight", "Handler calls currently running.", ["handler"]
+        )
+        self.errors = self.registry.counter(
+            "bot_handler_errors_total", "Handler calls that raised, by exception type.", ["handler", "exception"]
+        )
+        self.flow_steps = self.registry.counter(
+            "bot_flow_steps_total", "Steps reached in each conversation flow.", ["flow", "step"]
+        )
+        self.db_statements = self.registry.counter(
+            "bot_db_statements_total", "SQL statements run by the bot, by kind.", ["kind"]
+        )
+        self.db_rows = self.registry.counter(
+            "bot_db_rows_written_total", "Rows changed by INSERT, UPDATE and DELETE statements.", ["kind"]
+        )
+        self._db_lock = threading.Lock()
+
+    def wrap(self, name, function, flow=None, step=None):
+        # Telebot inspects the handler's parameters, functools.wraps keeps them visible
+        @functools.wraps(function)
+        async def instrumented(*args, **kwargs):
+            if flow is not None:
+                self.flow_steps.inc(flow, step)
+            self.in_flight.inc(name)
+            token = current_handler.set(name)
+            chat_token = current_chat.set(update_chat_id(args[0]) if args else None)
+            started = time.perf_counter()
+            try:
+                return await function(*args, **kwargs)
+            except Exception as e:
+                self.errors.inc(name, type(e).__name__)
+                raise
+            finally:
+                self.latency.observe(time.perf_counter() - started, name)
+                self.in_flight.dec(name)
+                current_handler.reset(token)
+                current_chat.reset(chat_token)
+        instrumented.instrumented = True
+        return instrumented
+
+    def _count_statement(self, connection, cursor, statement, parameters, context, executemany):
+        kind = statement_kind(statement)
+        rows = max(cursor.rowcount, 0) if kind in SQL_WRITE_KINDS else 0
+        # Runs on the DB executor threads
+        with self._db_lock:
+            self.db_statements.inc(kind)
+            if rows:
+                self.db_rows.inc(kind, amount=rows)
+
+    def instrument_database(self):
+        if not event.contains(Engine, "after_cursor_execute", self._count_statement):
+            event.listen(Engine, "after_cursor_execute", self._count_statement)
+
+    def count_step(self, flow, step):
+        self.flow_steps.inc(flow, step)
+
+    def instrument_bot(self, bot, skip=()):
+        # Handlers in `skip` (a router's dispatch) are measured per route by instrument_router
+        for handlers in (bot.message_handlers, bot.callback_query_handlers):
+            for handler in handlers:
+                function = handler["function"]
+                if function in skip:
+                    continue
+                if not getattr(function, "instrumented", False):
+                    handler["function"] = self.wrap(function.__qualname__, function)
+
+    def instrument_router(self, router):
+        for (flow, step), handler in router.routes.items():
+            if not getattr(handler, "instrumented", False):
+                name = f"{flow}_{step}" if step else flow
+                router.routes[(flow, step)] = self.wrap(name, handler, flow=flow, step=step)
+
+    async def handle(self, request):
+        return web.Response(body=self.registry.expose().encode(), headers={"Content-Type": CONTENT_TYPE})
+
+
+
+async def serve_metrics(metrics, host="0.0.0.0", port=9100, path="/metrics"):
+    """Serve `metrics` on its own aiohttp site, return the runner to clean up."""
+    app = web.Application()
+    app.router.add_get(path, metrics.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    print(f"Metrics on http://{host}:{port}{path}")
+    return runner
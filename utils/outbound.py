@@ -0,0 +1,196 @@
+import time
+import asyncio
+import contextvars
+from collections import deque
+from telebot import asyncio_helper
+from telebot.asyncio_helper import ApiTelegramException
+from utils.metrics import current_chat
+from utils.ratelimit import SlidingWindowLimiter, ChatRateLimiter, get_retry_after, TELEGRAM_GLOBAL_RATE
+
+
+
+# Highest priority first
+LANE_INTERACTIVE = "interactive"
+LANE_ADMIN = "admin"
+LANE_BULK = "bulk"
+LANES = (LANE_INTERACTIVE, LANE_ADMIN, LANE_BULK)
+
+# Requests queued per lane before callers are made to wait for room
+LANE_DEPTHS = {LANE_INTERACTIVE: 1000, LANE_ADMIN: 100, LANE_BULK: 50}
+
+# Lane of the requests made by the current task, None picks it by chat
+outbound_lane = contextvars.ContextVar("outbound_lane", default=None)
+
+
+def is_scheduled_method(name):
+    # Everything that posts or changes a message; reads, answers and chat actions are free
+    return (
+        (name.startswith("send") and name != "sendChatAction")
+        or name.startswith("editMessage")
+        or name in ("copyMessage", "forwardMessage")
+    )
+
+
+
+class OutboundScheduler:
+    """One queue in front of Telegram for every outgoing message.
+
+    Installed like ApiCallStats, around telebot's `_process_request`, so
+    every send_*, copy_message, forward_message and edit_* call of the bot
+    waits here for a slot. A single dispatcher hands out at most `rate`
+    slots in any `window` seconds, always to the highest priority lane
+    with a waiting request: interactive replies first, then replies to
+    admins, then bulk sends (broadcasts set `outbound_lane` to LANE_BULK).
+    Bulk sends never take the last `reserve` slots of a window, so a reply
+    finds one free even while a broadcast runs at full speed. `window` is
+    a little over Telegram's second, network jitter can bunch requests up.
+
+    Replies to the chat whose update is being handled (`current_chat`) go
+    out as fast as the global limit allows, so a result of four or five
+    messages is not stretched over seconds. Any other send is held to
+    `chat_interval` seconds between messages per chat after a short burst.
+    A 429 pauses every lane for the requested retry_after; interactive and
+    admin requests are then retried once instead of failing the reply.
+
+    Lanes are bounded by LANE_DEPTHS: once a lane is full new requests wait
+    for room, so a broadcast slows down instead of piling up.
+    """
+
+    def __init__(
+        self, metrics=None, admin_chat_ids=(),
+        rate=TELEGRAM_GLOBAL_RATE, window=1.1, reserve=5, chat_interval=1.0, chat_burst=3,
+        lane_depths=LANE_DEPTHS
+    ):
+        # Telebot sends chat_id as a string for sendMessage and as an int
+        # for the other methods, chats are always keyed by str(chat_id)
+        self.admin_chat_ids = {str(chat_id) for chat_id in admin_chat_ids}
+        self.limiter = SlidingWindowLimiter(rate=rate, window=window)
+        self.reserve = reserve
+        self.chat_limiter = ChatRateLimiter(interval=chat_interval, burst=chat_burst)
+        self.lanes = {lane: deque() for lane in LANES}
+        self._room = {lane: asyncio.Semaphore(lane_depths[lane]) for lane in LANES}
+        self._wakeup = asyncio.Event()
+        self._arrived = asyncio.Event()
+        self._paused_until = 0.0
+        self._dispatcher = None
+        self._original = None
+        self.depth = self.wait = self.sent = self.retried = None
+        if metrics is not None:
+            registry = metrics.registry
+            self.depth = registry.gauge(
+                "bot_outbound_queue_depth", "Requests waiting in each outbound lane.", ["lane"]
+            )
+            self.wait = registry.histogram(
+                "bot_outbound_wait_seconds", "Time requests spent queued before going out.", ["lane"]
+            )
+            self.sent = registry.counter(
+                "bot_outbound_requests_total", "Requests let through, by lane.", ["lane"]
+            )
+            self.retried = registry.counter(
+                "bot_outbound_retries_total", "Requests sent again after a 429, by lane.", ["lane"]
+            )
+
+    def install(self):
+        if self._original is not None:
+            return
+        self._original = asyncio_helper._process_request
+        asyncio_helper._process_request = self._process_request
+
+    def uninstall(self):
+        if self._original is not None:
+            asyncio_helper._process_request = self._original
+            self._original = None
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            self._dispatcher = None
+
+    def lane_for(self, chat_id):
+        lane = outbound_lane.get()
+        if lane is not None:
+            return lane
+        return LANE_ADMIN if chat_id in self.admin_chat_ids else LANE_INTERACTIVE
+
+    def is_reply(self, lane, chat_id):
+        # An answer to the update being handled, not a message the user did not ask for
+        return lane != LANE_BULK and chat_id is not None and chat_id == str(current_chat.get())
+
+    def _next_lane(self):
+        for lane in LANES:
+            if self.lanes[lane]:
+                return lane
+        return None
+
+    async def _dispatch(self):
+        while True:
+            await self._wakeup.wait()
+            if self._next_lane() is None:
+                self._wakeup.clear()
+                continue
+            delay = self._paused_until - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            lane = self._next_lane()
+            reserve = self.reserve if lane == LANE_BULK else 0
+            if not self.limiter.try_acquire(reserve):
+                # Woken early by a new request, it may be more urgent than this lane
+                self._arrived.clear()
+                try:
+                    await asyncio.wait_for(self._arrived.wait(), self.limiter.delay(reserve))
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            future = self.lanes[lane].popleft()
+            if self.depth is not None:
+                self.depth.dec(lane)
+            if not future.done():
+                future.set_result(None)
+
+    async def acquire(self, lane, chat_id=None):
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        started = time.monotonic()
+        async with self._room[lane]:
+            if chat_id is not None and not self.is_reply(lane, chat_id):
+                await self.chat_limiter.acquire(chat_id)
+            future = asyncio.get_running_loop().create_future()
+            self.lanes[lane].append(future)
+            if self.depth is not None:
+                self.depth.inc(lane)
+            self._wakeup.set()
+            self._arrived.set()
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future in self.lanes[lane]:
+                    self.lanes[lane].remove(future)
+                    if self.depth is not None:
+                        self.depth.dec(lane)
+                raise
+        if self.wait is not None:
+            self.wait.observe(time.monotonic() - started, lane)
+            self.sent.inc(lane)
+
+    async def _process_request(self, token, url, method="get", params=None, files=None, **kwargs):
+        if not is_scheduled_method(url):
+            return await self._original(token, url, method=method, params=params, files=files, **kwargs)
+        chat_id = (params or {}).get("chat_id")
+        if chat_id is not None:
+            chat_id = str(chat_id)
+        lane = self.lane_for(chat_id)
+        # Broadcasts retry on their own, and an upload's file has been read already
+        attempts = 1 if lane == LANE_BULK or files else 2
+        for attempt in range(attempts):
+            await self.acquire(lane, chat_id)
+            try:
+                return await self._original(token, url, method=method, params=params, files=files, **kwargs)
+            except ApiTelegramException as e:
+                retry_after = get_retry_after(e)
+                if retry_after is None:
+                    raise
+                # Flood control applies to the whole bot, every lane backs off
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+                if attempt + 1 == attempts:
+                    raise
+                if self.retried is not None:
+                    self.retried.inc(lane)
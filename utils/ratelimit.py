@@ -0,0 +1,114 @@
+import time
+import asyncio
+from collections import deque
+from telebot.asyncio_helper import ApiTelegramException
+
+
+
+# Telegram allows about 30 messages per second overall and one per second per chat
+TELEGRAM_GLOBAL_RATE = 30
+TELEGRAM_CHAT_INTERVAL = 1.0
+
+
+def get_retry_after(error, default=1):
+    """Seconds Telegram asked us to wait, or None if `error` is not a 429."""
+    if not isinstance(error, ApiTelegramException) or error.error_code != 429:
+        return None
+    parameters = (error.result_json or {}).get("parameters") or {}
+    return parameters.get("retry_after", default)
+
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, bursts up to `capacity`."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens=1):
+        self._refill()
+        if self._tokens >= tokens:
+            self._tokens -= tokens
+            return True
+        return False
+
+    async def acquire(self, tokens=1):
+        while not self.try_acquire(tokens):
+            await asyncio.sleep((tokens - self._tokens) / self.rate)
+
+
+
+class SlidingWindowLimiter:
+    """At most `rate` acquisitions in any `window` seconds, the way Telegram counts.
+
+    A continuously refilled bucket has to stay small not to overshoot a
+    sliding second; this lets an idle bot send a whole burst at once and
+    still never exceeds `rate` over any window. Callers passing `reserve`
+    leave that many slots of every window to the others.
+    """
+
+    def __init__(self, rate, window=1.0):
+        self.rate = rate
+        self.window = window
+        self._times = deque()
+
+    def _expire(self, now):
+        while self._times and self._times[0] <= now - self.window:
+            self._times.popleft()
+
+    def try_acquire(self, reserve=0):
+        now = time.monotonic()
+        self._expire(now)
+        if len(self._times) < self.rate - reserve:
+            self._times.append(now)
+            return True
+        return False
+
+    def delay(self, reserve=0):
+        """Seconds until `try_acquire(reserve)` can succeed."""
+        now = time.monotonic()
+        self._expire(now)
+        excess = len(self._times) - (self.rate - reserve)
+        if excess < 0:
+            return 0.0
+        return max(self._times[excess] + self.window - now, 0.0)
+
+    async def acquire(self, reserve=0):
+        while not self.try_acquire(reserve):
+            await asyncio.sleep(self.delay(reserve))
+
+
+
+class ChatRateLimiter:
+    """Keeps consecutive sends to the same chat at least `interval` seconds apart.
+
+    With `burst` > 1 that many sends may go out back to back before the
+    interval applies (a wizard step often sends two or three messages).
+    """
+
+    def __init__(self, interval=TELEGRAM_CHAT_INTERVAL, max_chats=100000, burst=1):
+        self.interval = interval
+        self.max_chats = max_chats
+        self.burst = burst
+        self._next_at = {}
+
+    def _prune(self, now):
+        self._next_at = {chat_id: at for chat_id, at in self._next_at.items() if at > now}
+
+    async def acquire(self, chat_id):
+        now = time.monotonic()
+        if len(self._next_at) > self.max_chats:
+            self._prune(now)
+        next_at = max(now, self._next_at.get(chat_id, now))
+        self._next_at[chat_id] = next_at + self.interval
+        delay = next_at - now - (self.burst - 1) * self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
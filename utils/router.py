@@ -0,0 +1,83 @@
+from functools import lru_cache
+
+
+
+class CallbackPayload:
+    """Callback data parsed once into `flow_step_value`.
+
+    "kua_decade_1320" -> flow="kua", step="decade", value=1320
+    "mashhad_button"  -> flow="mashhad", step="button", value=None
+    Numeric values are returned as int, everything else as str. Payloads are
+    cached and shared between updates, so handlers must not modify them.
+    """
+
+    __slots__ = ("flow", "step", "value", "data")
+
+    def __init__(self, flow, step=None, value=None, data=None):
+        self.flow = flow
+        self.step = step
+        self.value = value
+        self.data = data
+
+    @classmethod
+    @lru_cache(maxsize=4096)
+    def parse(cls, data):
+        parts = data.split("_", 2)
+        step = parts[1] if len(parts) > 1 else None
+        value = parts[2] if len(parts) > 2 else None
+        if value is not None and value.isdigit():
+            value = int(value)
+        return cls(parts[0], step, value, data)
+
+    def __repr__(self):
+        return f"CallbackPayload(flow={self.flow!r}, step={self.step!r}, value={self.value!r})"
+
+
+
+class CallbackRouter:
+    """Dispatch table from (flow, step) to callback handlers.
+
+    Registered on the bot as a single catch-all callback handler, so matching
+    costs one dict lookup however many flows exist. Handlers receive the
+    query and its parsed payload. With `answer=True` the query is answered
+    before the handler runs, so the button stops spinning right away and the
+    handler must not answer it again:
+
+        @router.route("kua", "decade", answer=True)
+        async def handle_decade(call, payload): ...
+    """
+
+    def __init__(self):
+        self.routes = {}
+        self.answered = set()
+        self.bot = None
+
+    def route(self, flow, step=None, answer=False):
+        def decorator(handler):
+            key = (flow, step)
+            if key in self.routes:
+                raise ValueError(f"Route {flow}_{step} is already registered")
+            self.routes[key] = handler
+            if answer:
+                self.answered.add(key)
+            return handler
+        return decorator
+
+    def resolve(self, data):
+        payload = CallbackPayload.parse(data)
+        return self.routes.get((payload.flow, payload.step)), payload
+
+    async def dispatch(self, call):
+        if not call.data:
+            return
+        handler, payload = self.resolve(call.data)
+        if handler is None:
+            print(f"No route for callback data: {call.data}")
+            return
+        if (payload.flow, payload.step) in self.answered:
+            await self.bot.answer_callback_query(callback_query_id=call.id)
+        await handler(call, payload)
+
+    def attach(self, bot):
+        self.bot = bot
+        bot.register_callback_query_handler(self.dispatch, func=None)
@@ -0,0 +1,213 @@
+import json
+import time
+import asyncio
+import functools
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from sqlmodel import Session, select, delete
+from models import ConversationState
+
+
+
+# One thread for every state read and write: a later drop can never reach
+# the table before an earlier save, and a read sees every write queued before it
+state_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="state")
+
+
+
+class UserState:
+    """Compact record of where a user is inside a multi-step flow.
+
+    One record per user: starting a flow (register, mashhad, kua, zodiac)
+    replaces whatever the user was doing before. Unset fields are not stored.
+    """
+
+    __slots__ = (
+        "user_id",
+        "flow",
+        "step",
+        "phone_number",
+        "name",
+        "birth_year",
+        "birth_month",
+        "birth_day",
+        "gender",
+        "expires_at",
+    )
+
+    FIELDS = __slots__[1:-1]
+
+    def __init__(self, user_id, flow, step=None, expires_at=None, **fields):
+        self.user_id = user_id
+        self.flow = flow
+        self.step = step
+        self.expires_at = expires_at
+        for field in self.FIELDS[2:]:
+            setattr(self, field, fields.pop(field, None))
+        if fields:
+            raise TypeError(f"Unknown state fields: {', '.join(fields)}")
+
+    def to_json(self):
+        data = {field: getattr(self, field) for field in self.FIELDS}
+        return json.dumps({key: value for key, value in data.items() if value is not None}, separators=(",", ":"))
+
+    @classmethod
+    def from_json(cls, user_id, data, expires_at=None):
+        return cls(user_id=user_id, expires_at=expires_at, **json.loads(data))
+
+    def __repr__(self):
+        return f"UserState({self.user_id}, {self.to_json()})"
+
+
+
+class MemoryStateStore:
+    """In-memory state store with per-entry TTL and LRU eviction above `max_size`.
+
+    Every method is awaitable so persistent backends can do their I/O off
+    the event loop; `step_filter` builds message handler filters from `is_at`.
+    """
+
+    def __init__(self, ttl=3600, max_size=100000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._states = OrderedDict()
+
+    def __len__(self):
+        return len(self._states)
+
+    def _get(self, user_id):
+        state = self._states.get(user_id)
+        if state is None:
+            return None
+        if state.expires_at <= time.time():
+            del self._states[user_id]
+            return None
+        return state
+
+    async def get(self, user_id):
+        return self._get(user_id)
+
+    async def is_at(self, user_id, flow, step):
+        state = await self.get(user_id)
+        return state is not None and state.flow == flow and state.step == step
+
+    def step_filter(self, flow, step):
+        """Message handler filter matching users at `step` of `flow`."""
+        async def is_at_step(message):
+            return await self.is_at(message.chat.id, flow, step)
+        return is_at_step
+
+    def _remember(self, state):
+        self._states[state.user_id] = state
+        self._states.move_to_end(state.user_id)
+        while len(self._states) > self.max_size:
+            self._states.popitem(last=False)
+
+    def _put(self, state, ttl=None):
+        state.expires_at = time.time() + (ttl or self.ttl)
+        self._remember(state)
+
+    async def save(self, state, ttl=None):
+        self._put(state, ttl)
+
+    async def drop(self, user_id):
+        self._states.pop(user_id, None)
+
+
+
+class SQLiteStateStore(MemoryStateStore):
+    """Store backed by the `conversationstate` table, so flows survive a
+    restart and are shared by every bot process on the same database.
+
+    The table is the source of truth: a state is served from memory only
+    for `cache_ttl` seconds after this process read or wrote it, which
+    covers the filters and handler of one update. After that it is read
+    again, since the user's next step may have been handled by another
+    process. Memory is bounded by `max_size`; rows expire with their TTL
+    and are swept at most once every `sweep_interval` seconds. Reads go to
+    `read_engine` so they never queue for the single writer connection.
+    """
+
+    def __init__(self, engine, read_engine=None, ttl=3600, max_size=100000, cache_ttl=1.0, sweep_interval=300):
+        super().__init__(ttl=ttl, max_size=max_size)
+        self.engine = engine
+        self.read_engine = read_engine or engine
+        self.cache_ttl = cache_ttl
+        self.sweep_interval = sweep_interval
+        self._next_sweep = 0.0
+        # user_id -> monotonic time memory last matched the table
+        self._synced = OrderedDict()
+        self._delete_expired()
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(state_executor, functools.partial(func, *args))
+
+    def _delete_expired(self):
+        self._next_sweep = time.monotonic() + self.sweep_interval
+        with Session(self.engine) as session:
+            session.exec(delete(ConversationState).where(ConversationState.expires_at <= time.time()))
+            session.commit()
+
+    def _read(self, user_id):
+        with Session(self.read_engine) as session:
+            return session.exec(
+                select(ConversationState).where(
+                    ConversationState.user_id == user_id,
+                    ConversationState.expires_at > time.time()
+                )
+            ).first()
+
+    def _write(self, user_id, data, expires_at):
+        with Session(self.engine) as session:
+            session.merge(ConversationState(user_id=user_id, data=data, expires_at=expires_at))
+            session.commit()
+        if time.monotonic() >= self._next_sweep:
+            self._delete_expired()
+
+    def _delete(self, user_id):
+        with Session(self.engine) as session:
+            session.exec(delete(ConversationState).where(ConversationState.user_id == user_id))
+            session.commit()
+
+    def _mark_synced(self, user_id):
+        now = time.monotonic()
+        self._synced[user_id] = now
+        self._synced.move_to_end(user_id)
+        while self._synced and now - next(iter(self._synced.values())) >= self.cache_ttl:
+            self._synced.popitem(last=False)
+
+    async def get(self, user_id):
+        synced_at = self._synced.get(user_id)
+        if synced_at is not None and time.monotonic() - synced_at < self.cache_ttl:
+            return self._get(user_id)
+        started = time.monotonic()
+        row = await self._run(self._read, user_id)
+        if self._synced.get(user_id, 0) >= started:
+            # Saved or dropped here while reading, memory is newer than the row
+            return self._get(user_id)
+        self._states.pop(user_id, None)
+        if row is not None:
+            self._remember(UserState.from_json(row.user_id, row.data, row.expires_at))
+        self._mark_synced(user_id)
+        return self._get(user_id)
+
+    async def save(self, state, ttl=None):
+        self._put(state, ttl)
+        self._mark_synced(state.user_id)
+        # Serialised now, a later change of the same state can not overtake it
+        await self._run(self._write, state.user_id, state.to_json(), state.expires_at)
+
+    async def drop(self, user_id):
+        await super().drop(user_id)
+        self._mark_synced(user_id)
+        await self._run(self._delete, user_id)
+
+
+
+def create_state_store(backend, engine=None, read_engine=None, ttl=3600, max_size=100000, cache_ttl=1.0):
+    if backend == "memory":
+        return MemoryStateStore(ttl=ttl, max_size=max_size)
+    if backend == "sqlite":
+        return SQLiteStateStore(engine=engine, read_engine=read_engine, ttl=ttl, max_size=max_size, cache_ttl=cache_ttl)
+    raise ValueError(f"Unknown state store backend: {backend}")
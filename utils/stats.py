@@ -0,0 +1,116 @@
+from sqlalchemy import func, delete
+from sqlmodel import Session, select
+from models import StatCounter, User, Kua, Zodiac, Mashhad
+from utils.database import dialect_insert
+
+
+
+# Kept up to date by the writes themselves, so reading them is O(1)
+COUNTERS = ("users", "mashhad", "kua_calculations", "zodiac_calculations")
+REGISTRATION_PREFIX = "registrations:"
+
+
+def registration_counter(create_date):
+    return f"{REGISTRATION_PREFIX}{create_date:%Y-%m-%d}"
+
+
+def increment_counters(session, engine, deltas):
+    """Add `deltas` ({name: delta}) to the counters inside the caller's transaction."""
+    for name, delta in deltas.items():
+        statement = dialect_insert(engine, StatCounter).values(name=name, value=delta)
+        statement = statement.on_conflict_do_update(
+            index_elements=[StatCounter.name],
+            set_={"value": StatCounter.value + statement.excluded.value}
+        )
+        session.exec(statement)
+
+
+def get_counters(engine, names=COUNTERS):
+    with Session(engine) as session:
+        rows = session.exec(select(StatCounter).where(StatCounter.name.in_(names))).all()
+    values = {row.name: row.value for row in rows}
+    return {name: values.get(name, 0) for name in names}
+
+
+def get_registrations_per_day(engine, days=14):
+    # Counter names sort by date, newest first
+    with Session(engine) as session:
+        rows = session.exec(
+            select(StatCounter)
+            .where(StatCounter.name.startswith(REGISTRATION_PREFIX))
+            .order_by(StatCounter.name.desc())
+            .limit(days)
+        ).all()
+    return [(row.name[len(REGISTRATION_PREFIX):], row.value) for row in rows]
+
+
+def rebuild_counters(engine):
+    """Recompute every counter from the tables with COUNT/GROUP BY queries.
+
+    Run when the counters are missing (first start after upgrading). Visit
+    counts are reset by /reset, so the calculation counters restart from
+    the current count_visit sums.
+    """
+    with Session(engine) as session:
+        session.exec(delete(StatCounter))
+        deltas = {
+            "users": session.exec(select(func.count()).select_from(User)).one(),
+            "mashhad": session.exec(select(func.count()).select_from(Mashhad)).one(),
+            "kua_calculations": session.exec(select(func.coalesce(func.sum(Kua.count_visit), 0))).one(),
+            "zodiac_calculations": session.exec(select(func.coalesce(func.sum(Zodiac.count_visit), 0))).one(),
+        }
+        day = func.date(User.create_date)
+        for date, count in session.exec(select(day, func.count()).group_by(day)).all():
+            deltas[f"{REGISTRATION_PREFIX}{date}"] = count
+        increment_counters(session, engine, deltas)
+        session.commit()
+
+
+def ensure_counters(engine):
+    with Session(engine) as session:
+        if session.get(StatCounter, "users") is not None:
+            return
+    print("Stat counters are missing, rebuilding them from the tables")
+    rebuild_counters(engine)
+
+
+def get_distributions(engine, top=10):
+    """Top cities and the Zodiac and Kua distributions, one GROUP BY each.
+
+    These scan whole tables, call them through `run_db`.
+    """
+    count = func.count().label("count")
+    with Session(engine) as session:
+        return {
+            "top_cities": session.exec(
+                select(User.city, count).group_by(User.city).order_by(count.desc()).limit(top)
+            ).all(),
+            "zodiac": session.exec(
+                select(Zodiac.chinese_sign, count).group_by(Zodiac.chinese_sign).order_by(count.desc())
+            ).all(),
+            "kua": session.exec(
+                select(Kua.kua_number, count).group_by(Kua.kua_number).order_by(Kua.kua_number)
+            ).all(),
+        }
+
+
+def format_stats(counters, registrations, distributions):
+    lines = [
+        f"Users: {counters['users']}",
+        f"Mashhad registrations: {counters['mashhad']}",
+        f"Kua calculations: {counters['kua_calculations']}",
+        f"Zodiac calculations: {counters['zodiac_calculations']}",
+        "",
+        "Registrations per day:",
+        *(f"  {day}: {count}" for day, count in registrations),
+        "",
+        "Top cities:",
+        *(f"  {city or '-'}: {count}" for city, count in distributions["top_cities"]),
+        "",
+        "Zodiac signs:",
+        *(f"  {sign or '-'}: {count}" for sign, count in distributions["zodiac"]),
+        "",
+        "Kua numbers:",
+        *(f"  {kua_number or '-'}: {count}" for kua_number, count in distributions["kua"]),
+    ]
+    return "\n".join(lines)
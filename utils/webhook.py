@@ -0,0 +1,120 @@
+"""Webhook ingestion for the bot, served by aiohttp.
+
+Telegram POSTs every update to `path`; the request is checked against the
+secret token, parsed and put on a bounded queue that a fixed number of
+workers feed into `bot.process_new_updates`, i.e. the same handlers used by
+polling. A full queue answers 503 so Telegram retries the update later.
+The secret token is required, updates are never accepted without it.
+
+Local testing without Telegram: start the bot with BOT_MODE=webhook and no
+WEBHOOK_URL, then POST recorded updates, e.g.
+
+    curl -X POST localhost:8080/webhook \\
+         -H "X-Telegram-Bot-Api-Secret-Token: $WEBHOOK_SECRET" \\
+         -H "Content-Type: application/json" -d @update.json
+
+or replay a whole directory of them:
+
+    python -m utils.webhook http://localhost:8080/webhook updates/*.json
+"""
+import os
+import sys
+import hmac
+import json
+import asyncio
+from aiohttp import web, ClientSession
+from dotenv import load_dotenv
+from telebot import types
+
+
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookServer:
+
+    def __init__(self, bot, secret_token, path="/webhook", queue_size=1000, workers=8):
+        if not secret_token:
+            raise ValueError("WebhookServer needs a secret token")
+        self.bot = bot
+        self.secret_token = secret_token
+        self.path = path
+        self.queue_size = queue_size
+        self.workers = workers
+        self.queue = None
+        self._worker_tasks = []
+        self.app = web.Application()
+        self.app.router.add_post(path, self.handle_update)
+        self.app.on_startup.append(self._start_workers)
+        self.app.on_cleanup.append(self._stop_workers)
+
+    def _is_authorized(self, request):
+        if not self.secret_token:
+            return False
+        received = request.headers.get(SECRET_HEADER, "")
+        return hmac.compare_digest(received.encode(), self.secret_token.encode())
+
+    async def handle_update(self, request):
+        if not self._is_authorized(request):
+            return web.Response(status=401)
+        try:
+            update = types.Update.de_json(await request.json())
+        except Exception as e:
+            print(f"Invalid webhook payload: {e}")
+            return web.Response(status=400)
+        try:
+            self.queue.put_nowait(update)
+        except asyncio.QueueFull:
+            # Telegram re-delivers updates that were not acknowledged with 200
+            return web.Response(status=503)
+        return web.Response()
+
+    async def _worker(self):
+        while True:
+            update = await self.queue.get()
+            try:
+                await self.bot.process_new_updates([update])
+            except Exception as e:
+                print(f"Error processing update {update.update_id}: {e}")
+            finally:
+                self.queue.task_done()
+
+    async def _start_workers(self, app):
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def _stop_workers(self, app, drain_timeout=10):
+        try:
+            await asyncio.wait_for(self.queue.join(), drain_timeout)
+        except asyncio.TimeoutError:
+            print(f"Dropping {self.queue.qsize()} queued updates on shutdown")
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+
+    async def serve(self, host="0.0.0.0", port=8080):
+        runner = web.AppRunner(self.app)
+        await runner.setup()
+        site = web.TCPSite(runner, host, port)
+        await site.start()
+        print(f"Webhook listening on http://{host}:{port}{self.path}")
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await runner.cleanup()
+
+
+
+async def replay_updates(url, paths, secret_token=None):
+    headers = {SECRET_HEADER: secret_token} if secret_token else {}
+    async with ClientSession() as session:
+        for path in paths:
+            with open(path, "r", encoding="utf-8") as file:
+                update = json.load(file)
+            async with session.post(url, json=update, headers=headers) as response:
+                print(f"{path}: {response.status}")
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    asyncio.run(replay_updates(sys.argv[1], sys.argv[2:], os.getenv("WEBHOOK_SECRET")))